@@ -0,0 +1,12 @@
+import pytest
+
+
+@pytest.fixture(autouse=True, scope='session')
+def test_settings():
+    """То же окружение, что у manage.py test: см. core.test_runner."""
+    from core.test_runner import TestSettings
+
+    settings = TestSettings()
+    settings.enable()
+    yield
+    settings.disable()
@@ -0,0 +1,176 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)'
+)
+CULL_EVERY = 200
+
+
+class SQLiteCache(BaseCache):
+    """Кеш в отдельном файле SQLite, общий для всех процессов сервера.
+
+    В отличие от LocMemCache, страницу, собранную одним воркером, видят
+    остальные. Файл работает в режиме WAL: чтения не ждут записей.
+    incr и add атомарны между процессами благодаря блокировке записи
+    SQLite, на них держатся поколения posts.cache и блокировки
+    core.caching.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self.local = threading.local()
+        self.writes = 0
+
+    @property
+    def connection(self):
+        # соединение свое у каждого потока и у каждого процесса после fork
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE сразу берет блокировку записи: между чтением
+        # и записью данные не изменит другой процесс
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def _write(self, sql, params):
+        cursor = self.connection.execute(sql, params)
+        self.writes += 1
+        if self.writes % CULL_EVERY == 0:
+            self._cull()
+        return cursor
+
+    def _cull(self):
+        now = time.time()
+        self.connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', [now])
+        total, = self.connection.execute(
+            'SELECT count(*) FROM cache').fetchone()
+        if total > self._max_entries:
+            self.connection.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                [total // self._cull_frequency])
+
+    def _live(self, key):
+        return self.connection.execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            [key, time.time()]).fetchone()
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        row = self._live(key)
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self.make_key(key, version=version): key for key in keys}
+        for key in keys:
+            self.validate_key(key)
+        if not keys:
+            return {}
+        rows = self.connection.execute(
+            'SELECT key, value FROM cache WHERE key IN ({}) '
+            'AND (expires IS NULL OR expires > ?)'.format(
+                ', '.join('?' * len(keys))),
+            [*keys, time.time()])
+        return {keys[key]: pickle.loads(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._write(
+            'INSERT OR REPLACE INTO cache (key, value, expires) '
+            'VALUES (?, ?, ?)',
+            [key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+             self.get_backend_timeout(timeout)])
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        with self.transaction():
+            for key, value in data.items():
+                self.set(key, value, timeout, version)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        # истекшая запись не должна мешать add: сначала удаляем ее
+        with self.transaction():
+            self.connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                [key, time.time()])
+            cursor = self._write(
+                'INSERT OR IGNORE INTO cache (key, value, expires) '
+                'VALUES (?, ?, ?)',
+                [key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                 self.get_backend_timeout(timeout)])
+        return cursor.rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self.transaction():
+            row = self._live(key)
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            self.connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                [pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key])
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        cursor = self._write(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            [self.get_backend_timeout(timeout), key, time.time()])
+        return cursor.rowcount == 1
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._live(key) is not None
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._write('DELETE FROM cache WHERE key = ?', [key])
+
+    def keys(self, prefix='', version=None):
+        """Живые ключи, начинающиеся с prefix, без префикса кеша."""
+        start = self.make_key(prefix, version=version)
+        skip = len(self.make_key('', version=version))
+        rows = self.connection.execute(
+            'SELECT key FROM cache WHERE substr(key, 1, ?) = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            [len(start), start, time.time()])
+        return [key[skip:] for key, in rows]
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
@@ -0,0 +1,61 @@
+import time
+
+from django.core.cache import cache
+
+LOCK_KEY = 'lock:{}'
+# Сколько отдавать устаревшее значение, пока его пересчитывают
+STALE_TIMEOUT = 60
+# Сколько держится блокировка пересчета, если процесс упал
+LOCK_TIMEOUT = 30
+WAIT_STEP = 0.05
+
+
+def _always(value):
+    return True
+
+
+def _store(key, tag, value, timeout, stale_timeout):
+    cache.set(key, (tag, time.time() + timeout, value),
+              timeout + stale_timeout)
+
+
+def get_or_compute(key, compute, timeout, tag=None,
+                   stale_timeout=STALE_TIMEOUT, lock_timeout=LOCK_TIMEOUT,
+                   cacheable=_always):
+    """Значение из кеша, пересчитываемое одним процессом за раз.
+
+    Запись хранит метку версии tag и срок свежести. Когда запись
+    устарела (истек timeout или сменилась метка), ее пересчитывает
+    тот, кто первым взял блокировку, а остальные еще stale_timeout
+    секунд получают прежнее значение. Если значения нет совсем,
+    остальные ждут пересчета не дольше lock_timeout.
+
+    Возвращает пару (значение, свежее ли оно).
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        entry_tag, fresh_until, value = entry
+        if entry_tag == tag and time.time() < fresh_until:
+            return value, True
+    lock = LOCK_KEY.format(key)
+    if cache.add(lock, 1, lock_timeout):
+        try:
+            value = compute()
+            if cacheable(value):
+                _store(key, tag, value, timeout, stale_timeout)
+        finally:
+            cache.delete(lock)
+        return value, True
+    if entry is not None:
+        return entry[2], False
+
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline and cache.has_key(lock):
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None and entry[0] == tag:
+            return entry[2], True
+    value = compute()
+    if cacheable(value):
+        _store(key, tag, value, timeout, stale_timeout)
+    return value, True
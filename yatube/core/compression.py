@@ -0,0 +1,77 @@
+import struct
+import zlib
+from collections import namedtuple
+
+from core.holes import HOLE_RE, fill_hole
+from core.media import ACCEPTS_GZIP_RE
+
+# Заголовок gzip без имени файла и времени, XFL=2 — максимальное сжатие
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
+# Пустой последний блок deflate с фиксированными кодами Хаффмана
+FINAL_BLOCK = b'\x03\x00'
+# Фрагменты пользователя маленькие и сжимаются в каждом запросе
+FILL_LEVEL = 6
+
+# segments: (начало, конец, deflate) кусков оболочки между метками
+# в байтах ее content, holes: (имя, параметры) меток
+CompressedShell = namedtuple('CompressedShell', 'segments holes')
+
+
+def accepts_gzip(request):
+    return bool(ACCEPTS_GZIP_RE.search(
+        request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+def deflate(data, level=9):
+    """Сырой deflate, выровненный по байту и без последнего блока.
+
+    Такие куски можно склеивать друг с другом в один поток.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def compress_shell(content, charset):
+    """Сжимает оболочку страницы по кускам между метками core.holes.
+
+    Исходные байты кусков не копируются: они уже есть в самой
+    оболочке, хранятся только их границы в content.
+    """
+    text = content.decode(charset)
+    bounds = []
+    holes = []
+    start = position = 0
+    for match in HOLE_RE.finditer(text):
+        end = start + len(text[position:match.start()].encode(charset))
+        bounds.append((start, end))
+        holes.append(match.groups())
+        start = end + len(match.group().encode(charset))
+        position = match.end()
+    bounds.append((start, len(content)))
+    return CompressedShell(
+        [(start, end, deflate(content[start:end])) for start, end in bounds],
+        holes)
+
+
+def gzip_page(request, shell, content, charset):
+    """Страница в gzip: сжатая оболочка и фрагменты текущего пользователя.
+
+    Заново сжимаются только фрагменты, а CRC32 и длина считаются по
+    исходным байтам из content: это намного дешевле, чем сжимать всю
+    страницу.
+    """
+    content = memoryview(content)
+    fills = [fill_hole(request, name, params).encode(charset)
+             for name, params in shell.holes]
+    fills.append(b'')
+    body = [GZIP_HEADER]
+    crc = size = 0
+    for (start, end, packed), fill in zip(shell.segments, fills):
+        crc = zlib.crc32(fill, zlib.crc32(content[start:end], crc))
+        size += end - start + len(fill)
+        body.append(packed)
+        if fill:
+            body.append(deflate(fill, FILL_LEVEL))
+    body.append(FINAL_BLOCK)
+    body.append(struct.pack('<II', crc, size & 0xffffffff))
+    return b''.join(body)
@@ -0,0 +1,40 @@
+import logging
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """Следит, чтобы представление укладывалось в limit SQL-запросов.
+
+    Превышение пишется в лог, а при QUERY_BUDGET_RAISE (в тестах)
+    приводит к исключению QueryBudgetExceeded.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count):
+                response = view(request, *args, **kwargs)
+            if len(queries) > limit:
+                message = '%s: %d SQL-запросов при бюджете %d' % (
+                    view.__name__, len(queries), limit)
+                if settings.QUERY_BUDGET_RAISE:
+                    raise QueryBudgetExceeded(
+                        '\n'.join([message] + queries))
+                logger.warning(message, extra={'request': request})
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,58 @@
+import re
+from urllib.parse import parse_qsl, urlencode
+
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+# «Дыры» в закешированной странице: фрагменты, зависящие от пользователя.
+# Страница кешируется одна на всех с метками вместо них, а фрагменты
+# дорисовываются для каждого запроса. Пользовательский текст на страницах
+# экранируется, поэтому подделать метку из поста нельзя.
+HOLE_MARK = '<!--hole:{}:{}-->'
+HOLE_RE = re.compile(r'<!--hole:(\w+):([^>]*?)-->')
+
+HOLES = {}
+
+
+def register(name):
+    """Регистрирует функцию (request, **params) -> HTML фрагмента."""
+    def decorator(func):
+        HOLES[name] = func
+        return func
+    return decorator
+
+
+def render_hole(request, name, params):
+    if getattr(request, 'page_shell', False):
+        return mark_safe(HOLE_MARK.format(name, urlencode(params)))
+    return mark_safe(HOLES[name](request, **params))
+
+
+def fill_hole(request, name, params):
+    """HTML фрагмента по имени и параметрам из метки."""
+    return HOLES[name](request, **dict(parse_qsl(params)))
+
+
+def fill_holes(request, content):
+    """Подставляет в оболочку страницы фрагменты текущего пользователя."""
+    return HOLE_RE.sub(
+        lambda match: fill_hole(request, *match.groups()), content)
+
+
+@register('header')
+def header(request):
+    return render_to_string('includes/header.html', request=request)
+
+
+@register('switcher')
+def switcher(request, **flags):
+    return render_to_string('includes/switcher.html', flags, request=request)
+
+
+@register('csrf')
+def csrf(request):
+    return format_html(
+        '<input type="hidden" name="csrfmiddlewaretoken" value="{}">',
+        get_token(request))
@@ -0,0 +1,184 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# как в django.middleware.gzip
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+# имена после collectstatic с ManifestStaticFilesStorage: name.<md5[:12]>.ext
+HASHED_STATIC_RE = r'\.[0-9a-f]{12}\.[^/.]+$'
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeFile:
+    """Часть файла для FileResponse.
+
+    У обертки нет fileno(), поэтому сервер не отдаст через sendfile
+    файл целиком до конца, а прочитает только нужные байты.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def resolve(root, path):
+    """Абсолютный путь и stat файла внутри root или Http404.
+
+    Скрытые каталоги (например, карантин сборщика мусора) не отдаются.
+    """
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404
+    try:
+        fullpath = safe_join(root, path)
+        info = os.stat(fullpath)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404
+    return fullpath, info
+
+
+def parse_range(header, size):
+    """(начало, длина) одного диапазона, None — весь файл, ValueError — 416.
+
+    Несколько диапазонов сразу не поддерживаются: отдается весь файл,
+    это разрешено RFC 7233.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), size)
+        if not length:
+            raise ValueError('Пустой диапазон')
+        return size - length, length
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError('Диапазон за пределами файла')
+    return first, last - first + 1
+
+
+def cache_control(path, immutable):
+    """Год для имен, которые меняются вместе с содержимым, иначе проверка."""
+    if any(re.search(pattern, path) for pattern in immutable):
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return 'no-cache'
+
+
+def offload(fullpath, path):
+    """Ответ без тела, файл по заголовку отдает фронтенд-сервер."""
+    response = HttpResponse()
+    if settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_PREFIX + quote(path))
+    else:
+        response['X-Sendfile'] = fullpath
+    return response
+
+
+def stream(request, fullpath, size, etag):
+    byte_range = None
+    header = request.META.get('HTTP_RANGE')
+    # If-Range: диапазон только от той же версии файла, иначе весь файл
+    if header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file)
+    else:
+        start, length = byte_range
+        response = FileResponse(RangeFile(file, start, length), status=206)
+        response['Content-Length'] = length
+        response['Content-Range'] = (
+            f'bytes {start}-{start + length - 1}/{size}')
+    # без wsgi.file_wrapper файл читается в Python кусками такого размера
+    response.block_size = CHUNK_SIZE
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def send_file(request, fullpath, info, path, cache, offload_path=None,
+              encoding=None):
+    """Ответ с файлом, уже найденным resolve.
+
+    Проверка пути и stat делаются один раз; с offload_path сами байты
+    отдает nginx или Apache, иначе FileResponse, который сервер
+    с wsgi.file_wrapper передает через os.sendfile. Диапазоны при
+    выгрузке разбирает фронтенд-сервер.
+    """
+    etag = '"{:x}-{:x}"'.format(info.st_size, info.st_mtime_ns)
+    last_modified = int(info.st_mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if offload_path is not None:
+            response = offload(fullpath, offload_path)
+        else:
+            response = stream(request, fullpath, info.st_size, etag)
+        content_type, _ = mimetypes.guess_type(path)
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(last_modified)
+    response['ETag'] = etag
+    response['Cache-Control'] = cache
+    return response
+
+
+def serve(request, path):
+    """Файл из MEDIA_ROOT с проверками, кешированием и Range."""
+    fullpath, info = resolve(settings.MEDIA_ROOT, path)
+    return send_file(
+        request, fullpath, info, path,
+        cache_control(path, settings.MEDIA_IMMUTABLE),
+        offload_path=path if settings.MEDIA_SENDFILE else None)
+
+
+def serve_static(request, path):
+    """Файл из STATIC_ROOT, сжатый заранее, если клиент принимает gzip.
+
+    collectstatic с core.storage кладет рядом с файлом name.gz;
+    сжимать в запросе не нужно.
+    """
+    fullpath, info = resolve(settings.STATIC_ROOT, path)
+    gzipped = fullpath + '.gz'
+    has_gzip = os.path.isfile(gzipped)
+    encoding = None
+    if has_gzip and ACCEPTS_GZIP_RE.search(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        fullpath, info, encoding = gzipped, os.stat(gzipped), 'gzip'
+    response = send_file(
+        request, fullpath, info, path,
+        cache_control(path, (HASHED_STATIC_RE,)), encoding=encoding)
+    if has_gzip:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,48 @@
+import gzip
+import os
+import shutil
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+# Что имеет смысл сжимать: картинки PNG и JPEG уже сжаты
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.ico', '.txt', '.json',
+                '.xml', '.html')
+
+
+def compress(path):
+    """Пишет path.gz с максимальным сжатием; False, если выигрыша нет.
+
+    mtime в заголовке gzip нулевой: при той же статике .gz получается
+    байт в байт тем же.
+    """
+    target = path + '.gz'
+    with open(path, 'rb') as source, open(target, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9,
+                           mtime=0) as compressed:
+            shutil.copyfileobj(source, compressed)
+    if os.path.getsize(target) >= os.path.getsize(path):
+        os.remove(target)
+        return False
+    return True
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Статика с хешем содержимого в имени и сжатыми копиями .gz.
+
+    Все делает collectstatic: {% static %} берет имена из манифеста,
+    а core.media.serve_static отдает готовый .gz.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        # один файл может прийти из нескольких проходов
+        hashed = {}
+        for name, hashed_name, processed in super().post_process(
+                paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed[hashed_name] = name
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in hashed:
+            if name.endswith(COMPRESSIBLE) and compress(self.path(name)):
+                yield name, name + '.gz', True
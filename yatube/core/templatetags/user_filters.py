@@ -1,5 +1,7 @@
 from django import template
 
+from core.holes import render_hole
+
 
 register = template.Library()
 
@@ -7,3 +9,20 @@ register = template.Library()
 @register.filter
 def addclass(field, css):
     return field.as_widget(attrs={'class': css})
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor=None):
+    """Ссылка на страницу по курсору с сохранением остальных параметров."""
+    query = context['request'].GET.copy()
+    query.pop('page', None)
+    query.pop('cursor', None)
+    if cursor:
+        query['cursor'] = cursor
+    return '?' + query.urlencode()
+
+
+@register.simple_tag(takes_context=True)
+def hole(context, name, **params):
+    """Фрагмент, который дорисовывается для каждого пользователя отдельно."""
+    return render_hole(context['request'], name, params)
@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestSettings:
+    """Настройки на время запуска тестов.
+
+    Тесты чистят кеши, поэтому файлы SQLiteCache переносятся во
+    временный каталог: кеш разработчика или сервера остается цел,
+    а параллельные запуски не делят один файл. Превышение бюджета
+    запросов core.decorators.query_budget в тестах — ошибка.
+    """
+
+    def enable(self):
+        self.directory = tempfile.mkdtemp(prefix='yatube-cache-')
+        caches = {}
+        for alias, options in settings.CACHES.items():
+            if options['BACKEND'] == 'core.cache_backends.SQLiteCache':
+                options = dict(options, LOCATION=os.path.join(
+                    self.directory, os.path.basename(options['LOCATION'])))
+            caches[alias] = options
+        self.override = override_settings(
+            CACHES=caches, QUERY_BUDGET_RAISE=True)
+        self.override.enable()
+
+    def disable(self):
+        self.override.disable()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = TestSettings()
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from core.cache_backends import SQLiteCache
+from core.caching import LOCK_KEY, get_or_compute
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {})
+
+    def test_shared_between_instances(self):
+        """Запись одного процесса видна другому"""
+        self.cache.set('key', {'value': 1})
+        other = SQLiteCache(self.path, {})
+        self.assertEqual(other.get('key'), {'value': 1})
+        self.assertEqual(other.get_many(['key', 'missing']),
+                         {'key': {'value': 1}})
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_add_incr_and_expiry(self):
+        """add, incr и истечение работают как у встроенных бэкендов"""
+        self.assertTrue(self.cache.add('counter', 1))
+        self.assertFalse(self.cache.add('counter', 5))
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.incr('counter', 10), 12)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+        self.cache.set('short', 'value', 0.05)
+        self.assertTrue(self.cache.has_key('short'))
+        time.sleep(0.1)
+        self.assertFalse(self.cache.has_key('short'))
+        self.assertTrue(self.cache.add('short', 'again'))
+        self.cache.set('forever', 'value', None)
+        self.assertEqual(self.cache.get('forever'), 'value')
+
+    def test_incr_is_atomic(self):
+        """Параллельные incr не теряют увеличений"""
+        self.cache.set('counter', 0)
+
+        def work():
+            for _ in range(50):
+                self.cache.incr('counter')
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+
+class GetOrComputeTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self, value='value', delay=0):
+        def compute():
+            self.calls += 1
+            time.sleep(delay)
+            return value
+        return compute
+
+    def test_single_flight(self):
+        """Значение считает один поток, остальные ждут его"""
+        results = []
+
+        def work():
+            results.append(
+                get_or_compute('key', self.compute(delay=0.2), 60))
+        threads = [threading.Thread(target=work) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [('value', True)] * 5)
+
+    def test_stale_while_revalidate(self):
+        """Пока значение пересчитывают, отдается прежнее"""
+        get_or_compute('key', self.compute('old'), 60, tag=1)
+        self.assertEqual(
+            get_or_compute('key', self.compute('new'), 60, tag=1),
+            ('old', True))
+        cache.add(LOCK_KEY.format('key'), 1)
+        self.assertEqual(
+            get_or_compute('key', self.compute('new'), 60, tag=2),
+            ('old', False))
+        cache.delete(LOCK_KEY.format('key'))
+        self.assertEqual(
+            get_or_compute('key', self.compute('new'), 60, tag=2),
+            ('new', True))
+        self.assertEqual(self.calls, 2)
+
+    def test_not_cacheable(self):
+        """Значения, которые нельзя кешировать, считаются каждый раз"""
+        for _ in range(2):
+            get_or_compute('key', self.compute(), 60,
+                           cacheable=lambda value: False)
+        self.assertEqual(self.calls, 2)
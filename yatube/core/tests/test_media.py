@@ -0,0 +1,151 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+CONTENT = bytes(range(256)) * 4
+HASHED = 'posts/ab/cd/' + 'abcd' * 16 + '.jpg'
+
+
+class MediaViewTest(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root, MEDIA_SENDFILE=None)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for name in (HASHED, 'posts/old.jpg', '.quarantine/old.jpg'):
+            path = os.path.join(root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(CONTENT)
+        self.root = root
+
+    def get(self, path, **headers):
+        return self.client.get('/media/' + path, **headers)
+
+    def test_full_file(self):
+        """Файл целиком с типом, длиной и кешированием по имени"""
+        response = self.get(HASHED)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.get('posts/old.jpg')['Cache-Control'],
+                         'no-cache')
+
+    def test_range(self):
+        """Range отдает 206 с нужными байтами или 416"""
+        cases = {
+            'bytes=10-19': (10, 20),
+            'bytes=1000-': (1000, 1024),
+            'bytes=-4': (1020, 1024),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header=header):
+                response = self.get(HASHED, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b''.join(response.streaming_content),
+                                 CONTENT[start:end])
+                self.assertEqual(response['Content-Range'],
+                                 f'bytes {start}-{end - 1}/1024')
+        response = self.get(HASHED, HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+        response = self.get(HASHED, HTTP_RANGE='bytes=0-9',
+                            HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional(self):
+        """Повторный запрос с ETag или датой получает 304"""
+        first = self.get(HASHED)
+        response = self.get(HASHED, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.get(
+            HASHED, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_offload(self):
+        """С MEDIA_SENDFILE тело отдает фронтенд-сервер"""
+        with self.settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.get(HASHED)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/' + HASHED)
+        self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.get(HASHED)
+        self.assertEqual(response['X-Sendfile'],
+                         os.path.join(self.root, HASHED))
+
+    def test_not_found(self):
+        """Скрытые каталоги, выход из MEDIA_ROOT и каталоги — 404"""
+        for path in ('.quarantine/old.jpg', '../etc/passwd', 'posts/',
+                     'posts/missing.jpg'):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path).status_code, 404)
+
+
+class StaticFilesTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.root = tempfile.mkdtemp()
+        cls.settings = override_settings(
+            STATIC_ROOT=cls.root,
+            STATICFILES_STORAGE=(
+                'core.storage.CompressedManifestStaticFilesStorage'))
+        cls.settings.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.hashed = staticfiles_storage.stored_name(
+            'css/bootstrap.min.css')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        shutil.rmtree(cls.root)
+        super().tearDownClass()
+
+    def test_collectstatic(self):
+        """collectstatic пишет имена с хешем, манифест и сжатые копии"""
+        self.assertRegex(self.hashed,
+                         r'^css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+        path = os.path.join(self.root, self.hashed)
+        with open(path, 'rb') as plain, gzip.open(path + '.gz') as packed:
+            self.assertEqual(packed.read(), plain.read())
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.root, 'staticfiles.json')))
+        # картинки уже сжаты
+        self.assertFalse(any(
+            name.endswith(('.png.gz', '.jpg.gz'))
+            for _, _, names in os.walk(self.root) for name in names))
+
+    def test_gzip(self):
+        """Клиенту с gzip отдается готовый .gz, остальным — исходный файл"""
+        response = self.client.get(
+            '/static/' + self.hashed, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', response['Cache-Control'])
+        path = os.path.join(self.root, self.hashed)
+        with open(path + '.gz', 'rb') as packed:
+            self.assertEqual(b''.join(response.streaming_content),
+                             packed.read())
+        response = self.client.get('/static/' + self.hashed)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        with open(path, 'rb') as plain:
+            self.assertEqual(b''.join(response.streaming_content),
+                             plain.read())
+
+    def test_unhashed(self):
+        """Имя без хеша кешируется только с проверкой"""
+        response = self.client.get('/static/css/bootstrap.min.css')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
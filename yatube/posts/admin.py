@@ -1,15 +1,46 @@
 from django.contrib import admin
 from posts.models import Post, Group
+from posts.paginator import EstimatedCountPaginator
+from posts.search import search_posts
 
 
 class PostAdmin(admin.ModelAdmin):
     list_display = ('pk', 'text',
                     'pub_date', 'author', 'group')
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
+    autocomplete_fields = ('author',)
+    paginator = EstimatedCountPaginator
+    # Не считать всю таблицу ради «N из M» рядом с поиском
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_posts(search_term, queryset), False
+
+    def save_model(self, request, obj, form, change):
+        # Правка из формы или списка не перезаписывает comments_count
+        if change:
+            obj.save_edit()
+        else:
+            obj.save()
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(
+            db_field, request, **kwargs)
+        if db_field.name == 'group' and formfield is not None:
+            # Список групп читается один раз на запрос, а не для
+            # каждой строки редактируемого списка.
+            if not hasattr(request, '_group_choices'):
+                request._group_choices = list(formfield.choices)
+            formfield.choices = request._group_choices
+        return formfield
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        import posts.holes  # noqa: F401
+        import posts.signals  # noqa: F401
+        from posts import search
+        post_migrate.connect(search.install, sender=self)
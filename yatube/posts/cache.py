@@ -0,0 +1,225 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from core import compression
+from core.caching import get_or_compute
+from core.holes import fill_holes
+from posts.thumbnails import PENDING_MARK
+
+GENERATION_KEY = 'generation:{}'
+MODIFIED_KEY = 'modified:{}'
+SHELL_KEY = 'shell:{}:{}'
+# Меньше этого gzip почти ничего не выигрывает
+GZIP_MIN_SIZE = 200
+
+INDEX_SCOPE = 'posts'
+GROUP_SCOPE = 'group:{slug}'
+AUTHOR_SCOPE = 'author:{username}'
+
+
+def _new_generation():
+    # Берем время, а не 1: если ключ поколения вытеснят из кеша,
+    # новое значение не совпадет ни с одним из прежних.
+    return time.time_ns() // 1000
+
+
+def scope_key(template, scope):
+    """Ключ кеша области.
+
+    Слаги групп и имена пользователей бывают не ASCII, а memcached
+    принимает только ASCII без пробелов, поэтому область хешируется.
+    """
+    return template.format(hashlib.md5(scope.encode()).hexdigest())
+
+
+def get_generations(scopes):
+    """Текущие поколения областей кеша одним запросом к кешу."""
+    keys = [scope_key(GENERATION_KEY, scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    for scope, key in zip(scopes, keys):
+        if key not in generations:
+            if cache.add(key, _new_generation(), None):
+                # точное время изменений до этого момента неизвестно
+                cache.set(scope_key(MODIFIED_KEY, scope), time.time(), None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def _bump(scopes):
+    for scope in scopes:
+        key = scope_key(GENERATION_KEY, scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation(), None)
+    cache.set_many(
+        {scope_key(MODIFIED_KEY, scope): time.time() for scope in scopes},
+        None)
+
+
+def get_last_modified(scopes):
+    """Время последнего изменения областей или None, если оно неизвестно."""
+    keys = [scope_key(MODIFIED_KEY, scope) for scope in scopes]
+    stamps = cache.get_many(keys)
+    if len(stamps) < len(keys):
+        return None
+    return datetime.fromtimestamp(max(stamps.values()), timezone.utc)
+
+
+def bump_generations(*scopes):
+    """Инвалидирует все страницы, закешированные в этих областях.
+
+    Поколение меняется сразу и еще раз после коммита: страница,
+    собранная другим процессом до коммита, тоже станет недействительной.
+    """
+    scopes = {scope for scope in scopes if scope}
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def page_cache_key(request, view_name, generations):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'page:{}:{}:{}'.format(
+        view_name, path, '.'.join(map(str, generations)))
+
+
+def cacheable(shell):
+    return (
+        shell.status_code == 200
+        and not shell.streaming
+        and not shell.cookies
+        and PENDING_MARK.encode() not in shell.content
+    )
+
+
+def render_shell(view, request, *args, **kwargs):
+    """Рендерит страницу с метками вместо пользовательских фрагментов.
+
+    Оболочку, которая попадет в кеш, сразу сжимает: gzip считается
+    один раз на заполнение кеша, а не в каждом ответе.
+    """
+    request.page_shell = True
+    try:
+        shell = view(request, *args, **kwargs)
+    finally:
+        request.page_shell = False
+    if (cacheable(shell) and len(shell.content) >= GZIP_MIN_SIZE
+            and shell.get('Content-Type', '').startswith('text/html')):
+        shell.compressed = compression.compress_shell(
+            shell.content, shell.charset)
+    return shell
+
+
+def fill_response(request, shell):
+    """Ответ текущему пользователю из общей оболочки страницы."""
+    compressed = getattr(shell, 'compressed', None)
+    gzipped = compressed is not None and compression.accepts_gzip(request)
+    if gzipped:
+        content = compression.gzip_page(
+            request, compressed, shell.content, shell.charset)
+    else:
+        content = fill_holes(request, shell.content.decode(shell.charset))
+    response = HttpResponse(content, status=shell.status_code)
+    for header, value in shell.items():
+        response[header] = value
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    if compressed is not None:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def cache_page_versioned(timeout, *scopes):
+    """Кеширует страницу до изменения данных в одной из областей.
+
+    Области задаются шаблонами, которые заполняются аргументами
+    представления, например 'group:{slug}'. Поколения областей
+    увеличиваются сигналами из posts.signals. В кеше лежит одна
+    оболочка страницы на всех, вместе со сжатой копией: фрагменты
+    пользователя из core.holes дорисовываются при каждом ответе.
+    Устаревшую оболочку пересчитывает один запрос, остальные тем
+    временем получают прежнюю.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            generations = get_generations(
+                [scope.format(**kwargs) for scope in scopes])
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            shell, fresh = get_or_compute(
+                SHELL_KEY.format(view.__name__, path),
+                lambda: render_shell(view, request, *args, **kwargs),
+                timeout,
+                tag='.'.join(map(str, generations)),
+                cacheable=cacheable,
+            )
+            if shell.streaming:
+                return shell
+            response = fill_response(request, shell)
+            if not fresh:
+                # ETag и Last-Modified описывают новую версию страницы,
+                # прежнюю браузеру сохранять под ними нельзя
+                patch_cache_control(response, no_store=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def no_store_pending(view):
+    """Страницу с оригиналами вместо миниатюр браузер не сохраняет.
+
+    Поколения и версия поста не меняются, когда фоновый пул дорисует
+    миниатюры: с ETag или Last-Modified такая страница получала бы 304
+    и оставалась у клиента навсегда.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if (not response.streaming
+                and PENDING_MARK.encode() in response.content):
+            del response['ETag']
+            del response['Last-Modified']
+            patch_cache_control(response, no_store=True)
+        return response
+    return wrapper
+
+
+def condition_versioned(*scopes):
+    """Отвечает 304 Not Modified, если страница в областях не менялась.
+
+    ETag строится из тех же поколений, что и ключ cache_page_versioned,
+    поэтому совпадает, пока страница в кеше действительна. Last-Modified
+    отдается только анонимам: страница пользователя зависит от сессии,
+    а If-Modified-Since ее не учитывает.
+    """
+    def decorator(view):
+        def scopes_for(kwargs):
+            return [scope.format(**kwargs) for scope in scopes]
+
+        def etag(request, *args, **kwargs):
+            generations = get_generations(scopes_for(kwargs))
+            key = page_cache_key(request, view.__name__, generations)
+            # страница с дорисованными фрагментами своя у каждого,
+            # а сжатая и несжатая — разные представления
+            user_id = request.user.pk if request.user.is_authenticated else ''
+            encoding = 'gzip' if compression.accepts_gzip(request) else ''
+            return hashlib.md5(
+                f'{key}:{user_id}:{encoding}'.encode()).hexdigest()
+
+        def last_modified(request, *args, **kwargs):
+            if request.user.is_authenticated:
+                return None
+            return get_last_modified(scopes_for(kwargs))
+
+        return no_store_pending(condition(etag, last_modified)(view))
+    return decorator
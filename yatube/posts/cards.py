@@ -0,0 +1,53 @@
+import hashlib
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from posts import thumbnails
+
+CARD_KEY = 'card:{}:{}:{}'
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+CARD_TEMPLATE = 'includes/post_card.html'
+# Что показывает карточка поста на разных страницах
+VARIANTS = {
+    'full': {'show_author': True, 'show_image': True, 'show_group': True},
+    'group': {'show_author': True, 'show_image': True, 'show_group': False},
+    'profile': {'show_author': False, 'show_image': False,
+                'show_group': True},
+}
+
+
+def card_version(post, variant):
+    """Все, что видно на карточке: текст и картинку покрывает updated_at."""
+    options = VARIANTS[variant]
+    version = [post.updated_at.timestamp(), post.comments_count]
+    if options['show_author']:
+        version += [post.author.username, post.author.get_full_name()]
+    if options['show_group'] and post.group_id:
+        version.append(post.group.slug)
+    return hashlib.md5(repr(version).encode()).hexdigest()
+
+
+def card_key(post, variant):
+    return CARD_KEY.format(variant, post.pk, card_version(post, variant))
+
+
+def render_cards(posts, variant='full'):
+    """HTML карточек страницы: одно чтение кеша и рендер недостающих."""
+    options = VARIANTS[variant]
+    keys = [card_key(post, variant) for post in posts]
+    cards = cache.get_many(keys)
+    if options['show_image']:
+        thumbnails.prefetch([post.image for key, post in zip(keys, posts)
+                             if key not in cards])
+    missing = {}
+    for key, post in zip(keys, posts):
+        if key not in cards:
+            cards[key] = render_to_string(
+                CARD_TEMPLATE, {'post': post, **options})
+            # карточку с оригиналом вместо миниатюры не кешируем
+            if thumbnails.PENDING_MARK not in cards[key]:
+                missing[key] = cards[key]
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TIMEOUT)
+    return [cards[key] for key in keys]
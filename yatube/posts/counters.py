@@ -0,0 +1,59 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from posts.models import Comment, Fallow, Post, User, UserStats
+
+
+def _count(queryset, field):
+    """Подзапрос с числом строк queryset для OuterRef('pk')."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    ), 0)
+
+
+def recount_users(users=None):
+    """Пересчитывает счетчики пользователей целиком одним UPDATE."""
+    users = User.objects.all() if users is None else users
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=pk) for pk in users.values_list('pk', flat=True)),
+        ignore_conflicts=True,
+    )
+    UserStats.objects.filter(user__in=users).update(
+        posts_count=_count(Post.objects.all(), 'author'),
+        followers_count=_count(Fallow.objects.all(), 'author'),
+        following_count=_count(Fallow.objects.all(), 'user'),
+    )
+
+
+def recount_posts(posts=None):
+    posts = Post.objects.all() if posts is None else posts
+    posts.update(comments_count=_count(Comment.objects.all(), 'post'))
+
+
+def _shift(field, delta):
+    """F(field) + delta не ниже нуля.
+
+    Счетчик мог разойтись с данными (массовое удаление, правка в обход
+    сигналов): CHECK >= 0 не должен ронять удаление поста или
+    комментария. Расхождение исправляет recount_counters.
+    """
+    return Greatest(F(field) + delta, 0)
+
+
+def change_user(user_id, **deltas):
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: _shift(field, delta) for field, delta in deltas.items()})
+    if not updated and any(delta > 0 for delta in deltas.values()):
+        # строки еще нет (пользователь создан в обход сигналов):
+        # считаем ее с нуля, текущее изменение уже в базе. При удалении
+        # строки может не быть из-за каскада, тогда считать нечего.
+        recount_users(User.objects.filter(pk=user_id))
+
+
+def change_post(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=_shift('comments_count', delta))
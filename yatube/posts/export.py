@@ -0,0 +1,81 @@
+import json
+
+from django.db.models import Max
+
+from posts.models import Comment, Post
+
+# Строк, которые база отдает за один fetchmany при iterator()
+CHUNK_SIZE = 2000
+TYPES = ('post', 'comment')
+
+
+def parse_cursor(cursor):
+    """Курсор «id поста.id комментария» -> словарь; пустой — с нуля."""
+    if not cursor:
+        return dict.fromkeys(TYPES, 0)
+    try:
+        values = [int(value) for value in cursor.split('.')]
+    except ValueError:
+        raise ValueError(f'Неверный курсор {cursor!r}')
+    if len(values) != len(TYPES) or min(values) < 0:
+        raise ValueError(f'Неверный курсор {cursor!r}')
+    return dict(zip(TYPES, values))
+
+
+def format_cursor(bounds):
+    return '.'.join(str(bounds[kind]) for kind in TYPES)
+
+
+def current_bounds():
+    """Последние id на момент начала выгрузки.
+
+    Выгрузка ограничена ими сверху: строки, добавленные во время
+    выгрузки, попадут в следующую, а курсор известен заранее.
+    """
+    return {
+        'post': Post.objects.aggregate(last=Max('pk'))['last'] or 0,
+        'comment': Comment.objects.aggregate(last=Max('pk'))['last'] or 0,
+    }
+
+
+def _posts(since, upto):
+    rows = (
+        Post.objects.filter(pk__gt=since, pk__lte=upto)
+        .order_by('pk')
+        .values_list('pk', 'author__username', 'group__slug', 'text',
+                     'pub_date', 'image')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for pk, author, group, text, pub_date, image in rows:
+        row = {'type': 'post', 'id': pk, 'author': author, 'group': group,
+               'text': text, 'pub_date': pub_date.isoformat()}
+        if image:
+            row['image'] = image
+        yield row
+
+
+def _comments(since, upto):
+    rows = (
+        Comment.objects.filter(pk__gt=since, pk__lte=upto)
+        .order_by('pk')
+        .values_list('pk', 'post_id', 'author__username', 'text', 'created')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for pk, post_id, author, text, created in rows:
+        yield {'type': 'comment', 'id': pk, 'post': post_id,
+               'author': author, 'text': text,
+               'created': created.isoformat()}
+
+
+def export_lines(since, upto, types=TYPES):
+    """Строки NDJSON в формате, который принимает import_data.
+
+    Новые посты и комментарии между курсорами since и upto; правки
+    и удаления уже выгруженных строк сюда не попадают.
+    """
+    sources = {'post': _posts, 'comment': _comments}
+    for kind in TYPES:
+        if kind not in types:
+            continue
+        for row in sources[kind](since[kind], upto[kind]):
+            yield json.dumps(row, ensure_ascii=False) + '\n'
@@ -1,4 +1,6 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from posts import images
 from posts.models import Post, Comment
 
 
@@ -12,6 +14,13 @@ class PostForm(forms.ModelForm):
             'text': 'Текст нового поста'
         }
 
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        # новую загрузку проверяем и пересохраняем, прежний файл не трогаем
+        if isinstance(image, UploadedFile):
+            return images.normalize(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,18 @@
+from django.template.loader import render_to_string
+
+from core.holes import register
+from posts.models import Fallow
+
+
+@register('follow')
+def follow_button(request, username):
+    following = (
+        request.user.is_authenticated
+        and Fallow.objects.filter(
+            user=request.user, author__username=username).exists()
+    )
+    return render_to_string(
+        'includes/follow_button.html',
+        {'username': username, 'following': following},
+        request=request,
+    )
@@ -0,0 +1,145 @@
+import hashlib
+import math
+import os
+import re
+import tempfile
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.images import get_image_dimensions
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps
+
+# Форматы, которые принимаются и сохраняются как есть
+FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif',
+           'WEBP': 'image/webp'}
+JPEG_QUALITY = 90
+
+# То, что Post хранит о своей картинке; hash — sha256 содержимого
+ImageMeta = namedtuple('ImageMeta', 'width height size hash')
+NO_IMAGE = ImageMeta(None, None, None, '')
+
+# posts/ab/cd/<sha256>.<ext>: два уровня по 256 каталогов
+HASHED_RE = r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$'
+
+
+def _header(upload):
+    """Формат и размеры из заголовка: Image.open не декодирует пиксели."""
+    upload.seek(0)
+    try:
+        image = Image.open(upload)
+    except (OSError, Image.DecompressionBombError):
+        raise ValidationError('Файл не похож на картинку',
+                              code='invalid_image')
+    if image.format not in FORMATS:
+        raise ValidationError(
+            f'Формат {image.format} не поддерживается', code='invalid_image')
+    frames = getattr(image, 'n_frames', 1)
+    if image.width * image.height * frames > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            f'Картинка {image.width}×{image.height} слишком большая',
+            code='image_too_large')
+    return image
+
+
+def normalize(upload):
+    """Проверяет картинку и пересохраняет ее без метаданных.
+
+    Размеры проверяются до декодирования, поэтому «бомба» с огромным
+    разрешением в маленьком файле отклоняется, не занимая память.
+    Большая сторона уменьшается до IMAGE_MAX_SIDE: для JPEG через draft,
+    то есть декодер сразу отдает картинку в 2–8 раз меньше, для остальных
+    через reduce. Результат пишется во временный файл на диске, а не
+    в память. Анимированный GIF сохраняется как есть.
+    """
+    if upload.size > settings.IMAGE_MAX_BYTES:
+        raise ValidationError('Файл картинки слишком большой',
+                              code='image_too_large')
+    image = _header(upload)
+    if getattr(image, 'is_animated', False):
+        upload.seek(0)
+        return upload
+    image_format = image.format
+    side = settings.IMAGE_MAX_SIDE
+    scale = side / max(image.size)
+    if scale < 1:
+        # draft до загрузки: JPEG декодируется сразу уменьшенным в 2–8 раз,
+        # но не меньше итогового размера; остальное уменьшает reduce
+        image.draft(None, (math.ceil(image.width * scale),
+                           math.ceil(image.height * scale)))
+        image.thumbnail((side, side), reducing_gap=2.0)
+    image = ImageOps.exif_transpose(image)
+
+    options = {}
+    if image_format == 'JPEG':
+        options = {'quality': JPEG_QUALITY, 'optimize': True}
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+    # exif, xmp и текстовые чанки отбрасываются; цветовой профиль
+    # и прозрачность нужны, чтобы картинка выглядела так же
+    info = image.info
+    image.info = {key: info[key] for key in ('transparency',)
+                  if key in info}
+    if info.get('icc_profile'):
+        options['icc_profile'] = info['icc_profile']
+    output = tempfile.TemporaryFile()
+    image.save(output, image_format, **options)
+    image.close()
+    size = output.tell()
+    output.seek(0)
+    # у файла нет temporary_file_path, и хранилище копирует его
+    # кусками по chunks(), не читая целиком
+    return UploadedFile(output, upload.name, FORMATS[image_format], size)
+
+
+def describe(file):
+    """Размеры из заголовка, байты и sha256; файл читается кусками."""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    width, height = get_image_dimensions(file, close=False)
+    file.seek(0)
+    return ImageMeta(width, height, size, digest.hexdigest())
+
+
+def hashed_name(digest, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return f'posts/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def upload_to(instance, filename):
+    """Имя файла картинки по ее sha256, который Post.save уже посчитал."""
+    if not instance.image_hash:
+        return f'posts/{filename}'
+    return hashed_name(instance.image_hash, filename)
+
+
+def is_hashed(name):
+    return re.match(HASHED_RE, name) is not None
+
+
+@deconstructible
+class HashedStorage(FileSystemStorage):
+    """Хранилище картинок постов с именами по содержимому.
+
+    Файл с таким именем уже содержит те же байты, поэтому повторная
+    загрузка не пишется, а получает существующее имя. mtime файла
+    обновляется, как у новой загрузки: collect_media не трогает файлы
+    моложе --min-age, пока их пост не закоммичен.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name and is_hashed(name):
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass
+        return super().save(name, content, max_length)
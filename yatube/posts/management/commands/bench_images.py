@@ -0,0 +1,80 @@
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts import thumbnails
+from posts.models import Post
+
+# Миниатюра, которую карточки отдавали всем до вариантов
+BASELINE = ('960x339', {'crop': 'center', 'upscale': True,
+                        'format': 'JPEG'})
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает байты оригиналов, прежней миниатюры 960 JPEG и вариантов '
+        'THUMBNAIL_WIDTHS в WebP и JPEG на выборке картинок. Файлы '
+        'миниатюр не записываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Файлы картинок; без них — последние картинки постов')
+        parser.add_argument('--limit', type=int, default=50)
+
+    def sources(self, options):
+        if options['paths']:
+            for path in options['paths']:
+                path = os.path.abspath(path)
+                yield ImageFile(os.path.basename(path), FileSystemStorage(
+                    location=os.path.dirname(path)))
+            return
+        names = (
+            Post.objects.exclude(image='').order_by('-pk')
+            .values_list('image', flat=True)[:options['limit']]
+        )
+        for name in names:
+            yield ImageFile(name, default.storage)
+
+    def handle(self, *args, **options):
+        totals = Counter()
+        count = 0
+        for source in self.sources(options):
+            source_image = default.engine.get_image(source)
+            count += 1
+            totals['original'] += source.storage.size(source.name)
+            geometry, baseline = BASELINE
+            totals['baseline'] += len(thumbnails.backend.encode(
+                source, source_image, geometry, **baseline))
+            for width, image_format, geometry, variant in \
+                    thumbnails.variants():
+                totals[width, image_format] += len(
+                    thumbnails.backend.encode(
+                        source, source_image, geometry, **variant))
+        if not count:
+            self.stdout.write('Картинок нет')
+            return
+
+        def kb(size):
+            return f'{size / 1024:.1f} КБ'
+
+        def saving(size, base):
+            return f'{(size / base - 1) * 100:+.0f}%'
+
+        self.stdout.write(f'Картинок: {count}, оригиналы: '
+                          f'{kb(totals["original"])}')
+        self.stdout.write(f'Прежняя миниатюра 960 JPEG: '
+                          f'{kb(totals["baseline"])}')
+        for width in settings.THUMBNAIL_WIDTHS:
+            jpeg = totals[width, 'JPEG']
+            webp = totals[width, 'WEBP']
+            self.stdout.write(
+                f'{width} px: JPEG {kb(jpeg)}, WebP {kb(webp)} '
+                f'({saving(webp, jpeg)} к JPEG той же ширины, '
+                f'{saving(webp, totals["baseline"])} к прежней)')
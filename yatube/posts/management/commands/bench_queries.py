@@ -0,0 +1,117 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Index, Q
+
+from posts.models import Comment, Fallow, Group, Post, User
+
+# Индексы и ограничения из 0009_query_indexes, которые снимаются для
+# сравнения планов «до» и «после», и индексы внешних ключей,
+# которые были до этой миграции.
+BENCH_MODELS = (Post, Comment, Fallow)
+FOREIGN_KEYS = (
+    (Post, 'author'),
+    (Post, 'group'),
+    (Comment, 'post'),
+    (Fallow, 'user'),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими данными внутри транзакции, '
+        'выводит планы и время запросов представлений posts с индексами '
+        'и без них, затем откатывает все изменения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--authors', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # SQLite меняет схему только с отключенной проверкой внешних
+        # ключей, а отключить ее можно лишь вне транзакции.
+        with connection.constraint_checks_disabled(), transaction.atomic():
+            fixtures = self.seed(options)
+            self.report('С индексами', fixtures, options['repeat'])
+            self.drop_indexes()
+            self.report('До 0009_query_indexes', fixtures, options['repeat'])
+            transaction.set_rollback(True)
+
+    def seed(self, options):
+        rnd = random.Random(0)
+        User.objects.bulk_create(
+            User(username=f'bench_{i}') for i in range(options['authors']))
+        authors = list(User.objects.filter(username__startswith='bench_'))
+        Group.objects.bulk_create(
+            Group(title=f'bench {i}', slug=f'bench-{i}', description='')
+            for i in range(options['groups']))
+        groups = list(Group.objects.filter(slug__startswith='bench-'))
+        Post.objects.bulk_create(
+            (Post(text='bench', author=rnd.choice(authors),
+                  group=rnd.choice(groups))
+             for _ in range(options['posts'])))
+        post = Post.objects.filter(author__in=authors).last()
+        Comment.objects.bulk_create(
+            (Comment(post_id=post.pk + i % 100, author=rnd.choice(authors),
+                     text='bench')
+             for i in range(options['posts'] // 10)))
+        Fallow.objects.bulk_create(
+            Fallow(user=reader, author=author)
+            for reader in authors[:20] for author in authors[20:70])
+        middle = Post.objects.order_by('-pub_date', '-pk')[
+            options['posts'] // 2]
+        return {
+            'author': authors[25],
+            'group': groups[0],
+            'post': post,
+            'middle': middle,
+        }
+
+    def queries(self, fixtures):
+        seek = fixtures['middle']
+        newest = Post.objects.order_by('-pub_date', '-pk')
+        return {
+            'index': newest[:11],
+            'index, глубокая страница': newest.filter(
+                Q(pub_date__lte=seek.pub_date),
+                Q(pub_date__lt=seek.pub_date)
+                | Q(pub_date=seek.pub_date, pk__lt=seek.pk))[:11],
+            'group_posts': newest.filter(group=fixtures['group'])[:11],
+            'profile': newest.filter(author=fixtures['author'])[:11],
+            'post_detail, комментарии': Comment.objects.filter(
+                post=fixtures['post']).order_by('created', 'pk')[:20],
+            'profile, подписка': Fallow.objects.filter(
+                user=fixtures['author'], author=fixtures['author']),
+        }
+
+    def report(self, title, fixtures, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, queryset in self.queries(fixtures).items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            self.stdout.write(f'{name}: {elapsed:.2f} мс')
+            self.stdout.write('    ' + queryset.explain().replace(
+                '\n', '\n    '))
+
+    def drop_indexes(self):
+        """Возвращает схему к одиночным индексам внешних ключей."""
+        with connection.schema_editor() as editor:
+            for model in BENCH_MODELS:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+                # SQLite пересоздает таблицу по текущей модели, поэтому
+                # уникальное ограничение там снять нельзя.
+                if connection.vendor != 'sqlite':
+                    for constraint in model._meta.constraints:
+                        editor.remove_constraint(model, constraint)
+            for model, field in FOREIGN_KEYS:
+                editor.add_index(model, Index(
+                    fields=[field], name=f'bench_{model._meta.model_name}_'
+                                         f'{field}_idx'))
@@ -0,0 +1,133 @@
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts import thumbnails
+from posts.models import Post
+
+QUARANTINE = '.quarantine'
+# Файлы моложе этого могли быть сохранены до коммита своего поста
+MIN_AGE = 60 * 60
+BATCH_SIZE = 500
+
+
+def walk(root):
+    """Файлы под root как (относительный путь, stat) через os.scandir.
+
+    В памяти только стек открытых каталогов, а не список всех файлов.
+    Скрытые каталоги, в том числе карантин, пропускаются.
+    """
+    stack = ['']
+    while stack:
+        relative = stack.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                path = os.path.join(relative, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path.replace(os.sep, '/'), entry.stat()
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT файлы, на которые не ссылаются ни '
+        'Post.image, ни миниатюры этих картинок в хранилище sorl. '
+        'С --dry-run только считает, сколько места освободится, '
+        f'с --quarantine переносит файлы в MEDIA_ROOT/{QUARANTINE}.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--quarantine', action='store_true')
+        parser.add_argument('--min-age', type=int, default=MIN_AGE,
+                            help='Не трогать файлы моложе, секунд')
+
+    def referenced(self):
+        """Имена картинок постов и всех их миниатюр."""
+        storage = Post._meta.get_field('image').storage
+        names = set()
+        rows = (Post.objects.exclude(image='')
+                .values_list('image', flat=True).distinct().iterator())
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                return names
+            names.update(batch)
+            sources = [ImageFile(name, storage) for name in batch]
+            names.update(default.kvstore.thumbnail_names(sources))
+            # текущие варианты: их ключи могли выпасть из кеша
+            for source in sources:
+                names.update(
+                    thumbnails.backend.thumbnail_file(
+                        source, geometry, **options).name
+                    for _, _, geometry, options in thumbnails.variants())
+
+    def still_needed(self, root, path, deadline):
+        """Повторная проверка файла прямо перед удалением.
+
+        referenced() собран в начале: с тех пор файл могли загрузить
+        заново (HashedStorage обновляет mtime) или сослаться на него
+        из нового поста.
+        """
+        try:
+            if os.stat(os.path.join(root, path)).st_mtime > deadline:
+                return True
+        except FileNotFoundError:
+            return False
+        return (path.startswith('posts/')
+                and Post.objects.filter(image=path).exists())
+
+    def remove(self, root, path, storage, quarantine):
+        # хранилище ключей забывает картинку и ее миниатюры, иначе
+        # при повторной загрузке того же файла они считались бы готовыми
+        if path.startswith('posts/'):
+            default.kvstore.delete(ImageFile(path, storage))
+        fullpath = os.path.join(root, path)
+        try:
+            if quarantine:
+                target = os.path.join(root, QUARANTINE, path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(fullpath, target)
+            else:
+                os.remove(fullpath)
+        except FileNotFoundError:
+            # миниатюру уже удалило хранилище ключей вместе с источником
+            pass
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        root = settings.MEDIA_ROOT
+        storage = Post._meta.get_field('image').storage
+        referenced = self.referenced()
+        deadline = time.time() - options['min_age']
+        count = size = 0
+        for path, info in walk(root):
+            if path in referenced or info.st_mtime > deadline:
+                continue
+            if (not options['dry_run']
+                    and self.still_needed(root, path, deadline)):
+                continue
+            count += 1
+            size += info.st_size
+            if options['dry_run']:
+                self.stdout.write(path)
+                continue
+            self.remove(root, path, storage, options['quarantine'])
+        if options['dry_run']:
+            action = 'Можно освободить'
+        elif options['quarantine']:
+            action = 'В карантине'
+        else:
+            action = 'Удалено'
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{action}: {count} файлов, {size / 1024 / 1024:.1f} МБ '
+            f'за {elapsed:.1f} с'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково выгружает посты и комментарии в NDJSON (формат '
+        'import_data). С --since выгружаются только строки, появившиеся '
+        'после предыдущей выгрузки; новый курсор печатается в stderr.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-',
+                            help='Файл или «-» для stdout')
+        parser.add_argument('--since', help='Курсор прошлой выгрузки')
+        parser.add_argument('--type', action='append', choices=export.TYPES,
+                            dest='types', help='Что выгружать')
+
+    def handle(self, *args, **options):
+        try:
+            since = export.parse_cursor(options['since'])
+        except ValueError as error:
+            raise CommandError(error)
+        upto = export.current_bounds()
+        lines = export.export_lines(since, upto,
+                                    options['types'] or export.TYPES)
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+        else:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.writelines(lines)
+        self.stderr.write(f'Курсор: {export.format_cursor(upto)}')
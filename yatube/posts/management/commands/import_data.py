@@ -0,0 +1,339 @@
+import csv
+import json
+import sys
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from posts import counters, timeline
+from posts.cache import (AUTHOR_SCOPE, GROUP_SCOPE, INDEX_SCOPE,
+                         bump_generations)
+from posts.models import Comment, Fallow, Group, Post, User
+
+TYPES = ('group', 'post', 'comment', 'follow')
+# Сколько имен и слагов держать в памяти между порциями
+LOOKUP_CACHE_SIZE = 100000
+
+
+class SkipRow(Exception):
+    pass
+
+
+@contextmanager
+def explicit_dates():
+    """Отключает auto_now_add, чтобы сохранить даты из файла."""
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Lookup:
+    """Кеш «ключ -> pk», недостающие ключи дочитываются одним запросом."""
+
+    def __init__(self, queryset, field):
+        self.queryset = queryset
+        self.field = field
+        self.cache = {}
+
+    def load(self, keys):
+        missing = {key for key in keys if key and key not in self.cache}
+        if not missing:
+            return
+        if len(self.cache) + len(missing) > LOOKUP_CACHE_SIZE:
+            self.cache.clear()
+        self.cache.update(
+            self.queryset.filter(**{f'{self.field}__in': missing})
+            .values_list(self.field, 'pk'))
+
+    def get(self, key):
+        return self.cache.get(key)
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково загружает группы, посты, комментарии и подписки из '
+        'NDJSON или CSV. Каждая строка — объект с полем type '
+        '(group, post, comment, follow). Сигналы не вызываются: '
+        'счетчики, ленты и кеш страниц обновляются после каждой порции.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или «-» для stdin')
+        parser.add_argument('--format', choices=('ndjson', 'csv'))
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Строк в одном INSERT')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Строк в одной транзакции')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Создавать неизвестных пользователей')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('Размеры порций должны быть положительными')
+        self.batch_size = options['batch_size']
+        self.create_users = options['create_users']
+        self.users = Lookup(User.objects.all(), 'username')
+        self.groups = Lookup(Group.objects.all(), 'slug')
+        self.imported = self.skipped = 0
+        # id постов, которые уже были в базе: их комментарии из файла
+        # относятся к другому посту и тоже пропускаются
+        self.skipped_posts = set()
+
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv')
+                                    else 'ndjson')
+        started = time.monotonic()
+        with self.open(path) as stream, explicit_dates():
+            rows = self.read(stream, fmt)
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                with transaction.atomic():
+                    self.import_chunk(chunk)
+                if options['verbosity'] > 1:
+                    self.stdout.write(self.progress(started))
+            self.reset_sequences()
+        self.stdout.write(self.style.SUCCESS(self.progress(started)))
+
+    @contextmanager
+    def open(self, path):
+        if path == '-':
+            yield sys.stdin
+            return
+        try:
+            stream = open(path, encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(error)
+        with stream:
+            yield stream
+
+    def read(self, stream, fmt):
+        """Строки файла как (номер строки, словарь)."""
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                raise CommandError(f'Строка {number}: {error}')
+            if not isinstance(row, dict):
+                raise CommandError(f'Строка {number}: ожидался объект')
+            yield number, row
+
+    def progress(self, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        return (f'Загружено {self.imported}, пропущено {self.skipped} '
+                f'за {elapsed:.1f} с ({self.imported / elapsed:.0f} строк/с)')
+
+    def skip(self, number, reason):
+        self.skipped += 1
+        self.stderr.write(f'Строка {number}: {reason}')
+
+    def import_chunk(self, chunk):
+        rows = {kind: [] for kind in TYPES}
+        for number, row in chunk:
+            row = {key: value for key, value in row.items()
+                   if value not in ('', None)}
+            kind = row.get('type')
+            if kind not in rows:
+                self.skip(number, f'неизвестный type {kind!r}')
+                continue
+            rows[kind].append((number, row))
+
+        self.import_groups(rows['group'])
+        self.load_users(rows)
+        self.groups.load(row.get('group') for _, row in rows['post'])
+        posts = self.import_posts(rows['post'])
+        commented = self.import_comments(rows['comment'])
+        follows = self.import_follows(rows['follow'])
+        self.update_derived(posts, commented, follows)
+
+    def build(self, rows, factory):
+        objects = []
+        for number, row in rows:
+            try:
+                objects.append(factory(row))
+            except SkipRow as reason:
+                self.skip(number, reason)
+            except (KeyError, TypeError, ValueError) as error:
+                self.skip(number, f'неверное значение {error}')
+        return objects
+
+    def bulk_create(self, model, objects, **kwargs):
+        model.objects.bulk_create(objects, batch_size=self.batch_size,
+                                  **kwargs)
+        self.imported += len(objects)
+
+    def user_id(self, username):
+        user_id = self.users.get(username)
+        if user_id is None:
+            raise SkipRow(f'нет пользователя {username!r}')
+        return user_id
+
+    def date(self, value):
+        if not value:
+            return timezone.now()
+        date = parse_datetime(value)
+        if date is None:
+            raise ValueError(value)
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date)
+        return date
+
+    def load_users(self, rows):
+        usernames = set()
+        for kind, fields in (('post', ('author',)),
+                             ('comment', ('author',)),
+                             ('follow', ('user', 'author'))):
+            for _, row in rows[kind]:
+                usernames.update(row.get(field) for field in fields)
+        usernames.discard(None)
+        self.users.load(usernames)
+        missing = [name for name in usernames if self.users.get(name) is None]
+        if missing and self.create_users:
+            User.objects.bulk_create(
+                (User(username=name, password=make_password(None))
+                 for name in missing),
+                batch_size=self.batch_size, ignore_conflicts=True)
+            self.users.load(missing)
+            counters.recount_users(User.objects.filter(username__in=missing))
+
+    def import_groups(self, rows):
+        groups = self.build(rows, lambda row: Group(
+            slug=row['slug'], title=row['title'],
+            description=row.get('description', '')))
+        # уже существующие группы не перезаписываются
+        self.bulk_create(Group, groups, ignore_conflicts=True)
+
+    def import_posts(self, rows):
+        ids = set()
+        for _, row in rows:
+            try:
+                ids.add(int(row['id']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        # повторная загрузка выгрузки не падает на занятых ключах
+        taken = set(Post.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True))
+        self.skipped_posts.update(taken)
+
+        def factory(row):
+            pk = row.get('id')
+            if pk is not None:
+                pk = int(pk)
+                if pk in taken:
+                    raise SkipRow(f'пост {pk} уже есть')
+                taken.add(pk)
+            group_id = None
+            if row.get('group'):
+                group_id = self.groups.get(row['group'])
+                if group_id is None:
+                    raise SkipRow(f'нет группы {row["group"]!r}')
+            return Post(
+                pk=pk, text=row['text'],
+                author_id=self.user_id(row['author']), group_id=group_id,
+                image=row.get('image', ''),
+                pub_date=self.date(row.get('pub_date')))
+        posts = self.build(rows, factory)
+        if not posts:
+            return []
+        # SQLite не возвращает ключи из bulk_create: новые посты — это
+        # посты с явными id и все, что получило ключ больше прежнего.
+        last_pk = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+        self.bulk_create(Post, posts)
+        explicit = [post.pk for post in posts if post.pk is not None]
+        return list(
+            Post.objects.filter(Q(pk__gt=last_pk) | Q(pk__in=explicit))
+            .order_by().only('pk', 'author_id', 'group_id', 'pub_date'))
+
+    def import_comments(self, rows):
+        post_ids = set()
+        for _, row in rows:
+            try:
+                post_ids.add(int(row['post']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        existing = set(Post.objects.filter(pk__in=post_ids).values_list(
+            'pk', flat=True))
+
+        def factory(row):
+            post_id = int(row['post'])
+            if post_id not in existing:
+                raise SkipRow(f'нет поста {post_id}')
+            if post_id in self.skipped_posts:
+                raise SkipRow(f'пост {post_id} не загружен')
+            return Comment(
+                post_id=post_id, text=row['text'],
+                author_id=self.user_id(row['author']),
+                created=self.date(row.get('created')))
+        comments = self.build(rows, factory)
+        self.bulk_create(Comment, comments)
+        return {comment.post_id for comment in comments}
+
+    def import_follows(self, rows):
+        def factory(row):
+            user_id = self.user_id(row['user'])
+            author_id = self.user_id(row['author'])
+            if user_id == author_id:
+                raise SkipRow('подписка на самого себя')
+            return Fallow(user_id=user_id, author_id=author_id)
+        follows = self.build(rows, factory)
+        self.bulk_create(Fallow, follows, ignore_conflicts=True)
+        return {(follow.user_id, follow.author_id) for follow in follows}
+
+    def update_derived(self, posts, commented, follows):
+        """То, что при обычном сохранении делают сигналы posts.signals."""
+        users = {post.author_id for post in posts}
+        for edge in follows:
+            users.update(edge)
+        if users:
+            counters.recount_users(User.objects.filter(pk__in=users))
+        if commented:
+            counters.recount_posts(Post.objects.filter(pk__in=commented))
+        timeline.fan_out_many(posts)
+        for user_id, author_id in follows:
+            timeline.backfill(user_id, author_id)
+
+        authors = {post.author_id for post in posts}
+        authors.update(author for _, author in follows)
+        groups = {post.group_id for post in posts if post.group_id}
+        for author_id, group_id in Post.objects.filter(
+                pk__in=commented).values_list('author_id', 'group_id'):
+            authors.add(author_id)
+            groups.add(group_id)
+        scopes = {INDEX_SCOPE} if posts or commented else set()
+        scopes.update(
+            GROUP_SCOPE.format(slug=slug) for slug in Group.objects.filter(
+                pk__in=groups).values_list('slug', flat=True))
+        scopes.update(
+            AUTHOR_SCOPE.format(username=name) for name in User.objects
+            .filter(pk__in=authors).values_list('username', flat=True))
+        bump_generations(*scopes)
+
+    def reset_sequences(self):
+        """Посты могли прийти с явными id: сдвигаем счетчики ключей."""
+        statements = connection.ops.sequence_reset_sql(no_style(), [Post])
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
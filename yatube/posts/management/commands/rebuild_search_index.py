@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Создает полнотекстовый индекс постов и заполняет его заново.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not search.uses_fts(using):
+            self.stdout.write('База не поддерживает FTS5, поиск идет '
+                              'через LIKE')
+            return
+        search.install(using)
+        search.rebuild(using)
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
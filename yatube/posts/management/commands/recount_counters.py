@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.counters import recount_posts, recount_users
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики постов, подписчиков, подписок '
+            'и комментариев по данным в базе.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            recount_users()
+            recount_posts()
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
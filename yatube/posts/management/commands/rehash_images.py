@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.db.models.functions import Now
+from sorl.thumbnail.images import ImageFile
+
+from posts import images, thumbnails
+from posts.cache import (AUTHOR_SCOPE, GROUP_SCOPE, INDEX_SCOPE,
+                         bump_generations)
+from posts.models import Post
+
+FIELDS = ('image_width', 'image_height', 'image_size', 'image_hash')
+
+
+def rehash(storage, name):
+    """Копирует файл под имя по содержимому; None, если файла нет."""
+    try:
+        with storage.open(name) as file:
+            meta = images.describe(file)
+            new_name = storage.save(
+                images.hashed_name(meta.hash, name), file)
+    except OSError:
+        return None
+    return new_name, meta
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов из плоского каталога posts/ в '
+        'posts/ab/cd/<sha256>.<ext>. Одинаковые файлы сливаются в один. '
+        'Файлы копируются в нескольких потоках, пути в базе меняются '
+        'одним UPDATE на пачку, старые файлы и их миниатюры удаляются '
+        'после коммита.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=min(32, (os.cpu_count() or 1) * 4))
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        names = (
+            Post.objects.exclude(image='')
+            .exclude(image__regex=images.HASHED_RE)
+            .order_by('image').values_list('image', flat=True).distinct()
+        )
+        started = time.monotonic()
+        moved = skipped = 0
+        last = ''
+        with ThreadPoolExecutor(options['workers']) as pool:
+            while True:
+                # по ключу: перенесенные имена выпадают из выборки
+                batch = list(names.filter(image__gt=last)[
+                    :options['batch_size']])
+                if not batch:
+                    break
+                last = batch[-1]
+                results = pool.map(lambda name: rehash(storage, name), batch)
+                renamed = {}
+                for name, result in zip(batch, results):
+                    if result is None:
+                        skipped += 1
+                    else:
+                        renamed[name] = result
+                if renamed:
+                    self.update(renamed)
+                for name in renamed:
+                    thumbnails.backend.delete(ImageFile(name, storage))
+                moved += len(renamed)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено {moved}, пропущено {skipped} за {elapsed:.1f} с'))
+
+    def update(self, renamed):
+        """Новые пути и сведения о картинках одним UPDATE на пачку.
+
+        updated_at меняется, чтобы карточки со старыми адресами картинок
+        выпали из кеша; страницы инвалидируются, как при импорте.
+        """
+        columns = {field: {} for field in ('image',) + FIELDS}
+        for name, (new_name, meta) in renamed.items():
+            columns['image'][name] = new_name
+            for field in FIELDS:
+                columns[field][name] = getattr(meta, field[len('image_'):])
+        values = {
+            field: Case(*[When(image=name, then=Value(value))
+                          for name, value in mapping.items()],
+                        output_field=Post._meta.get_field(field))
+            for field, mapping in columns.items()
+        }
+        values['updated_at'] = Now()
+        posts = Post.objects.filter(image__in=list(renamed))
+        scopes = {INDEX_SCOPE}
+        for username, slug in posts.values_list(
+                'author__username', 'group__slug').distinct():
+            scopes.add(AUTHOR_SCOPE.format(username=username))
+            if slug:
+                scopes.add(GROUP_SCOPE.format(slug=slug))
+        with transaction.atomic():
+            posts.update(**values)
+            bump_generations(*scopes)
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:35
+
+from django.db import migrations, models
+import posts.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_post_image_meta'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, storage=posts.images.HashedStorage(), upload_to=posts.images.upload_to, verbose_name='Картинка'),
+        ),
+    ]
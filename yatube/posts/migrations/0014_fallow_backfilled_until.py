@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:54
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def mark_partial_feeds(apps, schema_editor):
+    # 0008 перенес в ленты не больше 100 постов каждого автора: ленты
+    # считаются полными только до самой старой перенесенной записи
+    Fallow = apps.get_model('posts', 'Fallow')
+    Timeline = apps.get_model('posts', 'Timeline')
+    oldest = Timeline.objects.filter(
+        user_id=OuterRef('user_id'), author_id=OuterRef('author_id'),
+    ).order_by('pub_date').values('pub_date')[:1]
+    Fallow.objects.update(backfilled_until=Subquery(oldest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_image_hashed_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fallow',
+            name='backfilled_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_partial_feeds, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from posts import images
+
 User = get_user_model()
 
 
@@ -16,31 +18,76 @@ class Group(models.Model):
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='posts'
+        related_name='posts',
+        db_index=False
     )
     group = models.ForeignKey(
         Group,
         models.SET_NULL,
         related_name='posts',
         blank=True,
-        null=True
+        null=True,
+        db_index=False
     )
     image = models.ImageField(
         'Картинка',
-        upload_to='posts/',
+        upload_to=images.upload_to,
+        storage=images.HashedStorage(),
         blank=True
     )
+    # Заполняются при сохранении новой картинки, для старых постов —
+    # командой backfill_images: страницам не нужно открывать файл
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+    image_size = models.PositiveIntegerField(null=True, editable=False)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return self.text[:15]
 
+    def save(self, *args, **kwargs):
+        if not self.image:
+            self.set_image_meta(images.NO_IMAGE)
+        elif not self.image._committed:
+            self.set_image_meta(images.describe(self.image.file))
+        super().save(*args, **kwargs)
+
+    def save_edit(self):
+        """Сохраняет правку поста, не трогая comments_count.
+
+        Счетчик меняет только posts.counters через F(), а у
+        редактируемого экземпляра он может быть устаревшим.
+        """
+        self.save(update_fields=[
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name != 'comments_count'
+        ])
+
+    def set_image_meta(self, meta):
+        self.image_width = meta.width
+        self.image_height = meta.height
+        self.image_size = meta.size
+        self.image_hash = meta.hash
+
     class Meta:
         ordering = ['-pub_date']
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Индексы повторяют порядок CursorPaginator: (-pub_date, -id).
+        # Составные индексы заменяют одиночные индексы внешних ключей.
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -48,6 +95,7 @@ class Comment(models.Model):
         Post,
         on_delete=models.CASCADE,
         related_name='comments',
+        db_index=False
     )
     author = models.ForeignKey(
         User,
@@ -57,15 +105,75 @@ class Comment(models.Model):
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+        ]
+
 
 class Fallow(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='follower'
+        related_name='follower',
+        db_index=False
     )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='following'
     )
+    # Посты автора старше этой даты еще не перенесены в ленту подписчика,
+    # их дозаполняет posts.timeline.feed_page; None — перенесены все
+    backfilled_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'author'],
+                                    name='unique_follow'),
+        ]
+
+
+class UserStats(models.Model):
+    """Счетчики пользователя, которые поддерживает posts.counters."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats'
+    )
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+
+class Timeline(models.Model):
+    """Лента подписок, материализованная при публикации поста."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date', '-post']
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post']),
+            models.Index(fields=['user', 'author', '-pub_date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='unique_timeline_post'),
+        ]
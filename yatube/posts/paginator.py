@@ -0,0 +1,237 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class CursorPage(Page):
+    """Страница, полученная по курсору: знает только соседей."""
+
+    def __init__(self, object_list, number, paginator,
+                 has_next, has_previous):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<Cursor page %s>' % (self.number or '?')
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1 if self.number else None
+
+    def previous_page_number(self):
+        return self.number - 1 if self.number else None
+
+    @property
+    def next_cursor(self):
+        if not self.has_next() or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(
+            self.object_list[-1], 'next', self.next_page_number())
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous() or not self.object_list:
+            return None
+        return self.paginator.encode_cursor(
+            self.object_list[0], 'prev', self.previous_page_number())
+
+    @property
+    def last_cursor(self):
+        return self.paginator.encode_cursor(None, 'prev', None)
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация: без COUNT(*) и OFFSET на каждой странице.
+
+    Порядок задается списком полей, последним должно идти уникальное
+    поле (обычно pk), чтобы курсор однозначно указывал на запись.
+    Старые ссылки вида ?page=N продолжают работать через OFFSET.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-pk'),
+                 **kwargs):
+        self.ordering = tuple(ordering)
+        super().__init__(object_list.order_by(*self.ordering),
+                         per_page, **kwargs)
+
+    def _fields(self):
+        meta = self.object_list.model._meta
+        for name in self.ordering:
+            attname = name.lstrip('-')
+            if attname == 'pk':
+                field = meta.pk
+            else:
+                try:
+                    field = meta.get_field(attname)
+                except FieldDoesNotExist:
+                    # числовая аннотация, например ранг поиска
+                    field = None
+            yield attname, field, name.startswith('-')
+
+    def encode_cursor(self, obj, direction, number):
+        values = None
+        if obj is not None:
+            values = [
+                field.value_to_string(obj) if field
+                else getattr(obj, attname)
+                for attname, field, _ in self._fields()
+            ]
+        payload = json.dumps({'d': direction, 'v': values, 'n': number},
+                             separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(raw.decode())
+            direction = data['d']
+            number = data.get('n')
+            values = data['v']
+            if direction not in ('next', 'prev'):
+                raise ValueError(direction)
+            if number is not None:
+                number = int(number)
+                if number < 1:
+                    raise ValueError(number)
+            if values is not None:
+                fields = list(self._fields())
+                if len(values) != len(fields):
+                    raise ValueError(values)
+                values = [
+                    field.to_python(value) if field else float(value)
+                    for (_, field, _), value in zip(fields, values)
+                ]
+        except (binascii.Error, ValueError, TypeError, KeyError,
+                UnicodeDecodeError, ValidationError):
+            return None
+        return direction, values, number
+
+    def _seek(self, values, reverse):
+        """Условие «строго после курсора» в порядке сортировки.
+
+        Нестрогая граница по первому полю нужна, чтобы база читала
+        диапазон индекса, а не сканировала его с начала из-за OR.
+        """
+        condition = Q()
+        equal = {}
+        bound = None
+        for (attname, _, desc), value in zip(self._fields(), values):
+            lookup = 'lt' if desc != reverse else 'gt'
+            if bound is None:
+                bound = Q(**{f'{attname}__{lookup}e': value})
+            condition |= Q(**equal, **{f'{attname}__{lookup}': value})
+            equal[attname] = value
+        return bound & condition
+
+    def _reversed_ordering(self):
+        return [
+            name[1:] if name.startswith('-') else '-' + name
+            for name in self.ordering
+        ]
+
+    def get_page(self, number=None, cursor=None):
+        """Возвращает страницу по курсору, номеру или первую."""
+        decoded = self.decode_cursor(cursor) if cursor else None
+        if decoded is not None:
+            direction, values, page_number = decoded
+            if direction == 'next':
+                return self._page_after(values, page_number)
+            page = self._page_before(values, page_number)
+            if page.object_list or values is None:
+                return page
+        try:
+            number = max(int(number or 1), 1)
+        except (TypeError, ValueError):
+            number = 1
+        return self._page_at(number)
+
+    def _page_at(self, number):
+        bottom = (number - 1) * self.per_page
+        items = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not items and number > 1:
+            return self._page_before(None, None)
+        return CursorPage(items[:self.per_page], number, self,
+                          len(items) > self.per_page, number > 1)
+
+    def _page_after(self, values, number):
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse=False))
+        items = list(queryset[:self.per_page + 1])
+        return CursorPage(items[:self.per_page], number, self,
+                          len(items) > self.per_page, values is not None)
+
+    def _page_before(self, values, number):
+        queryset = self.object_list.order_by(*self._reversed_ordering())
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse=True))
+        items = list(queryset[:self.per_page + 1])
+        has_previous = len(items) > self.per_page
+        items = items[:self.per_page][::-1]
+        if not has_previous:
+            number = 1
+        return CursorPage(items, number, self,
+                          values is not None, has_previous)
+
+
+def estimate_count(model, using='default'):
+    """Число строк таблицы по статистике базы, без COUNT(*).
+
+    Возвращает None, если статистики нет: для SQLite она появляется
+    после ANALYZE, для PostgreSQL — после VACUUM/ANALYZE.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master "
+                "WHERE name = 'sqlite_stat1'")
+            if not cursor.fetchone()[0]:
+                return None
+            cursor.execute(
+                'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1',
+                [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    if not row or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор для больших таблиц в админке.
+
+    Для запроса без фильтров число строк берется из статистики базы:
+    точный COUNT(*) по миллионам строк читает всю таблицу. Маленькие
+    таблицы и отфильтрованные выборки считаются как обычно.
+    """
+
+    exact_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.exact_threshold:
+                return estimate
+        return super().count
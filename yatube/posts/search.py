@@ -0,0 +1,97 @@
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+
+from posts.models import Post
+
+# Полнотекстовый индекс SQLite FTS5 по Post.text. Таблица хранит только
+# индекс (content='posts_post'), синхронизацию делают триггеры, поэтому
+# в индекс попадают и bulk_create, и queryset.update().
+FTS_TABLE = 'posts_post_fts'
+FTS_TRIGGERS = {
+    'posts_post_fts_insert': (
+        'AFTER INSERT ON posts_post BEGIN '
+        'INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); '
+        'END'
+    ),
+    'posts_post_fts_delete': (
+        'AFTER DELETE ON posts_post BEGIN '
+        "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        'END'
+    ),
+    'posts_post_fts_update': (
+        'AFTER UPDATE OF text ON posts_post BEGIN '
+        "INSERT INTO posts_post_fts(posts_post_fts, rowid, text) "
+        "VALUES ('delete', old.id, old.text); "
+        'INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text); '
+        'END'
+    ),
+}
+WORD_RE = re.compile(r'\w+')
+
+
+def uses_fts(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def install(using='default', **kwargs):
+    """Создает индекс и триггеры, если их нет, и переиндексирует посты.
+
+    Вызывается после каждой миграции: SQLite пересоздает таблицу
+    posts_post при изменении схемы и теряет при этом триггеры.
+    """
+    if not uses_fts(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name = %s OR "
+            "(type = 'trigger' AND tbl_name = 'posts_post')", [FTS_TABLE])
+        existing = {name for name, in cursor.fetchall()}
+        if existing >= {FTS_TABLE, *FTS_TRIGGERS}:
+            return
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            "text, content='posts_post', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')")
+        for name, body in FTS_TRIGGERS.items():
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+        rebuild(using)
+
+
+def rebuild(using='default'):
+    if not uses_fts(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def match_expression(query):
+    """Запрос пользователя в синтаксисе FTS5: все слова, по префиксу."""
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query.lower()))
+
+
+def search_posts(query, queryset=None):
+    """Посты, подходящие под запрос, с рангом в аннотации rank.
+
+    Чем меньше rank, тем выше пост в выдаче (bm25 в FTS5 отрицателен).
+    """
+    queryset = Post.objects.all() if queryset is None else queryset
+    match = match_expression(query)
+    if not match:
+        return queryset.none().annotate(
+            rank=Value(0.0, output_field=FloatField()))
+    if not uses_fts(queryset.db):
+        return queryset.filter(text__icontains=query).annotate(
+            rank=Value(0.0, output_field=FloatField()))
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = posts_post.id', f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+    ).annotate(rank=RawSQL(f'{FTS_TABLE}.rank', (),
+                           output_field=FloatField()))
@@ -0,0 +1,132 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from posts import counters, timeline
+from posts.cache import (AUTHOR_SCOPE, GROUP_SCOPE, INDEX_SCOPE,
+                         bump_generations)
+from posts.models import Comment, Fallow, Group, Post, User, UserStats
+
+
+def post_scopes(post):
+    scopes = [INDEX_SCOPE, AUTHOR_SCOPE.format(username=post.author.username)]
+    if post.group_id:
+        scopes.append(GROUP_SCOPE.format(slug=post.group.slug))
+    return scopes
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, **kwargs):
+    """Запоминает прежнюю группу: ее страница тоже устареет."""
+    instance._old_group_slug = None
+    if instance.pk:
+        instance._old_group_slug = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('group__slug', flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    old_group_slug = getattr(instance, '_old_group_slug', None)
+    bump_generations(
+        *post_scopes(instance),
+        old_group_slug and GROUP_SCOPE.format(slug=old_group_slug),
+    )
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    bump_generations(*post_scopes(instance.post))
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_slug(sender, instance, **kwargs):
+    instance._old_slug = None
+    if instance.pk:
+        instance._old_slug = (
+            Group.objects.filter(pk=instance.pk)
+            .values_list('slug', flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_pages(sender, instance, **kwargs):
+    old_slug = getattr(instance, '_old_slug', None)
+    bump_generations(
+        INDEX_SCOPE,
+        GROUP_SCOPE.format(slug=instance.slug),
+        old_slug and GROUP_SCOPE.format(slug=old_slug),
+    )
+
+
+@receiver(post_save, sender=Fallow)
+@receiver(post_delete, sender=Fallow)
+def invalidate_follow_pages(sender, instance, **kwargs):
+    # у автора меняется число подписчиков, у читателя — число подписок
+    bump_generations(
+        AUTHOR_SCOPE.format(username=instance.author.username),
+        AUTHOR_SCOPE.format(username=instance.user.username),
+    )
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Fallow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Fallow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_user(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Fallow)
+def count_new_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user(instance.author_id, followers_count=1)
+        counters.change_user(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Fallow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.change_user(instance.author_id, followers_count=-1)
+    counters.change_user(instance.user_id, following_count=-1)
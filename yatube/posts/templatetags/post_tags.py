@@ -0,0 +1,22 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts import thumbnails
+from posts.cards import render_cards
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts, variant='full'):
+    """Карточки постов страницы из кеша фрагментов."""
+    return [mark_safe(card) for card in render_cards(list(posts), variant)]
+
+
+@register.inclusion_tag('includes/picture.html')
+def picture(image):
+    """<picture> с вариантами картинки; пока их нет — оригинал."""
+    return {'picture': thumbnails.get_picture(image),
+            'pending_mark': thumbnails.PENDING_MARK,
+            'aspect': '{} / {}'.format(*thumbnails.ASPECT)}
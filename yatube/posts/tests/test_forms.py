@@ -1,9 +1,14 @@
+import hashlib
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image, ImageFile
+from posts import images
 from posts.models import Group, Post, User, Comment
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -66,7 +71,11 @@ class PostCreateForm(TestCase):
         self.assertEqual(new_post.author.username, self.user.username)
         self.assertEqual(new_post.group.id, form_data['group'])
         self.assertEqual(new_post.text, form_data['text'])
-        self.assertEqual(new_post.image, f'posts/{uploaded.name}')
+        # форма пересохраняет картинку, имя — по хешу сохраненного файла
+        with new_post.image.open() as stored:
+            digest = hashlib.sha256(stored.read()).hexdigest()
+        self.assertEqual(new_post.image,
+                         images.hashed_name(digest, uploaded.name))
 
 
 class PostUpdateForm(TestCase):
@@ -158,3 +167,51 @@ class PostCommentForm(TestCase):
         self.assertEqual(new_post.text, form_data['text'])
 
 
+def jpeg_upload(width, height):
+    exif = Image.Exif()
+    exif[0x0110] = 'Камера'
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), 'red').save(
+        buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), 'image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ImageUploadTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def create(self, image):
+        return self.client.post(reverse('posts:post_create'),
+                                {'text': 'Фото', 'image': image})
+
+    @override_settings(IMAGE_MAX_SIDE=400)
+    def test_large_image_downsampled(self):
+        """Большая картинка уменьшается и теряет метаданные"""
+        self.create(jpeg_upload(1600, 800))
+        post = Post.objects.get()
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (400, 200))
+            self.assertEqual(image.format, 'JPEG')
+            self.assertNotIn('exif', image.info)
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_decompression_bomb_rejected(self):
+        """Слишком большое разрешение отклоняется без декодирования"""
+        upload = jpeg_upload(100, 100)
+        with mock.patch.object(ImageFile.ImageFile, 'load') as load:
+            response = self.create(upload)
+        load.assert_not_called()
+        self.assertFormError(response, 'form', 'image',
+                             'Картинка 100×100 слишком большая')
+        self.assertFalse(Post.objects.exists())
@@ -1,10 +1,37 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
 
-from posts.models import Group, Post
+from posts import images, thumbnails
+from posts.management.commands import collect_media
+from posts.models import Comment, Fallow, Group, Post, Timeline, UserStats
+from posts.paginator import CursorPaginator
 
 User = get_user_model()
 NUM_CHAR = 15
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
 
 
 class PostModelTest(TestCase):
@@ -29,3 +56,367 @@ class PostModelTest(TestCase):
         post = PostModelTest.post
         expected_name = self.post.text[:NUM_CHAR]
         self.assertEqual(expected_name, str(post))
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+
+    @skipUnless(connection.vendor == 'sqlite', 'План запроса SQLite')
+    def test_listings_read_index_without_sorting(self):
+        """Ленты читаются по индексу без сортировки во временном дереве"""
+        newest = Post.objects.order_by('-pub_date', '-pk')
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        querysets = {
+            'index': newest[:11],
+            'keyset': newest.filter(paginator._seek(
+                [self.post.pub_date, self.post.pk], reverse=False))[:11],
+            'group': newest.filter(group=self.group)[:11],
+            'profile': newest.filter(author=self.user)[:11],
+            'comments': Comment.objects.filter(
+                post=self.post).order_by('created', 'pk'),
+        }
+        for name, queryset in querysets.items():
+            with self.subTest(name=name):
+                plan = queryset.explain()
+                self.assertIn('USING INDEX', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на автора запрещена"""
+        author = User.objects.create_user(username='author')
+        Fallow.objects.create(user=self.user, author=author)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Fallow.objects.create(user=self.user, author=author)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """Счетчики меняются вместе с постами, комментариями и подписками"""
+        post = Post.objects.create(author=self.user, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий')
+        follow = Fallow.objects.create(user=self.reader, author=self.user)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+        self.assertEqual(self.stats(self.user).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.stats(self.user).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+        post.delete()
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+
+    def test_drifted_counters_do_not_block_deletes(self):
+        """Разошедшийся счетчик не роняет удаление и не уходит ниже нуля"""
+        post = Post.objects.create(author=self.user, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий')
+        Post.objects.update(comments_count=0)
+        UserStats.objects.update(posts_count=0)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        post.delete()
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+
+    def test_edit_keeps_comments_count(self):
+        """Правка устаревшего экземпляра не сбрасывает comments_count"""
+        post = Post.objects.create(author=self.user, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        post.text = 'Исправленный пост'
+        post.save_edit()
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'Исправленный пост')
+        self.assertEqual(post.comments_count, 1)
+
+    def test_recount_command(self):
+        """Команда recount_counters восстанавливает счетчики"""
+        post = Post.objects.create(author=self.user, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        UserStats.objects.update(posts_count=100)
+        Post.objects.update(comments_count=100)
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('recount_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+        self.assertEqual(self.stats(self.reader).posts_count, 0)
+
+
+class ImportDataTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def import_file(self, suffix, content, *args):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, delete=False, encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_data', file.name, *args,
+                     stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_ndjson(self):
+        """NDJSON загружается порциями, производные данные обновляются"""
+        rows = [
+            {'type': 'group', 'slug': 'cats', 'title': 'Коты'},
+            {'type': 'follow', 'user': 'reader', 'author': 'auth'},
+            {'type': 'post', 'id': 1000, 'author': 'auth', 'group': 'cats',
+             'text': 'Первый', 'pub_date': '2020-01-01T10:00:00'},
+            {'type': 'post', 'id': 1001, 'author': 'newbie',
+             'text': 'Второй', 'pub_date': '2020-01-02T10:00:00'},
+            {'type': 'comment', 'post': 1000, 'author': 'reader',
+             'text': 'Комментарий'},
+            {'type': 'comment', 'post': 5, 'author': 'reader', 'text': '?'},
+            {'type': 'post', 'author': 'ghost', 'text': 'Без автора'},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows)
+        stdout, stderr = self.import_file(
+            '.ndjson', content, '--chunk-size=3', '--create-users')
+        self.assertIn('Загружено 6, пропущено 1', stdout)
+        self.assertIn('нет поста 5', stderr)
+
+        post = Post.objects.get(pk=1000)
+        self.assertEqual(post.group.slug, 'cats')
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(Post.objects.filter(author__username='ghost').exists())
+        self.assertEqual(UserStats.objects.get(user=self.user).posts_count, 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.user).followers_count, 1)
+        self.assertTrue(Timeline.objects.filter(
+            user=self.reader, post=post).exists())
+        self.assertGreater(Post.objects.create(
+            author=self.user, text='Новый').pk, 1001)
+
+    def test_import_csv(self):
+        """CSV с колонкой type, неизвестные пользователи пропускаются"""
+        content = (
+            'type,author,text,group\n'
+            'post,auth,Из CSV,\n'
+            'post,nobody,Чужой,\n'
+        )
+        stdout, stderr = self.import_file('.csv', content)
+        self.assertIn('Загружено 1, пропущено 1', stdout)
+        self.assertIn("Строка 3: нет пользователя 'nobody'", stderr)
+        self.assertTrue(Post.objects.filter(text='Из CSV').exists())
+
+    def test_export_round_trip(self):
+        """export_data выгружает строки в формате import_data"""
+        post = Post.objects.create(author=self.user, text='Туда и обратно')
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        stdout, stderr = StringIO(), StringIO()
+        call_command('export_data', stdout=stdout, stderr=stderr)
+        self.assertIn('Курсор: ', stderr.getvalue())
+        Post.objects.all().delete()
+        self.import_file('.ndjson', stdout.getvalue())
+        post = Post.objects.get(text='Туда и обратно')
+        self.assertEqual(post.comments_count, 1)
+
+    def test_existing_ids_skipped(self):
+        """Посты с уже занятыми id и их комментарии пропускаются"""
+        post = Post.objects.create(author=self.user, text='Уже есть')
+        rows = [
+            {'type': 'post', 'id': post.pk, 'author': 'auth',
+             'text': 'Повтор'},
+            {'type': 'post', 'id': 2000, 'author': 'auth', 'text': 'Новый'},
+            {'type': 'post', 'id': 2000, 'author': 'auth', 'text': 'Дубль'},
+            {'type': 'comment', 'post': post.pk, 'author': 'reader',
+             'text': 'К повтору'},
+        ]
+        stdout, stderr = self.import_file(
+            '.ndjson', '\n'.join(json.dumps(row) for row in rows))
+        self.assertIn('Загружено 1, пропущено 3', stdout)
+        self.assertIn(f'пост {post.pk} уже есть', stderr)
+        self.assertIn(f'пост {post.pk} не загружен', stderr)
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'Уже есть')
+        self.assertEqual(post.comments_count, 0)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(Post.objects.get(pk=2000).text, 'Новый')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageMetaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def assertMeta(self, post):
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertEqual(post.image_size, len(SMALL_GIF))
+        self.assertEqual(post.image_hash,
+                         hashlib.sha256(SMALL_GIF).hexdigest())
+
+    def test_meta_on_upload(self):
+        """Размеры и хеш картинки сохраняются вместе с постом"""
+        post = Post.objects.create(
+            author=self.user, text='Картинка',
+            image=SimpleUploadedFile('small.gif', SMALL_GIF, 'image/gif'))
+        self.assertMeta(post)
+        post.image = None
+        post.save()
+        post.refresh_from_db()
+        self.assertIsNone(post.image_width)
+        self.assertEqual(post.image_hash, '')
+
+    def test_backfill_images(self):
+        """backfill_images заполняет сведения о картинках старых постов"""
+        post = Post.objects.create(
+            author=self.user, text='Картинка',
+            image=SimpleUploadedFile('small.gif', SMALL_GIF, 'image/gif'))
+        missing = Post.objects.create(author=self.user, text='Без файла')
+        Post.objects.filter(pk=missing.pk).update(image='posts/nope.gif')
+        Post.objects.update(image_width=None, image_height=None,
+                            image_size=None, image_hash='')
+        stdout = StringIO()
+        call_command('backfill_images', '--workers=2', '--batch-size=1',
+                     stdout=stdout)
+        self.assertIn('Обновлено 1, пропущено 1', stdout.getvalue())
+        self.assertMeta(post)
+
+    def test_same_upload_stored_once(self):
+        """Одинаковые картинки лежат в одном файле с именем по хешу"""
+        first, second = [
+            Post.objects.create(
+                author=self.user, text='Картинка',
+                image=SimpleUploadedFile(name, SMALL_GIF, 'image/gif'))
+            for name in ('one.gif', 'two.gif')
+        ]
+        digest = hashlib.sha256(SMALL_GIF).hexdigest()
+        self.assertEqual(first.image.name,
+                         f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif')
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(
+            os.listdir(os.path.dirname(first.image.path)), [f'{digest}.gif'])
+
+    def test_rehash_images(self):
+        """rehash_images переносит старые файлы в каталоги по хешу"""
+        storage = Post._meta.get_field('image').storage
+        posts = []
+        for name in ('posts/old.gif', 'posts/copy.gif'):
+            storage.save(name, ContentFile(SMALL_GIF))
+            post = Post.objects.create(author=self.user, text='Старый')
+            Post.objects.filter(pk=post.pk).update(image=name)
+            posts.append(post)
+        Post.objects.create(author=self.user, text='Без картинки')
+        stdout = StringIO()
+        call_command('rehash_images', '--batch-size=1', stdout=stdout)
+        self.assertIn('Перенесено 2, пропущено 0', stdout.getvalue())
+        for post in posts:
+            self.assertMeta(post)
+            self.assertTrue(images.is_hashed(post.image.name))
+            self.assertTrue(storage.exists(post.image.name))
+        self.assertEqual(posts[0].image.name, posts[1].image.name)
+        self.assertFalse(storage.exists('posts/old.gif'))
+        self.assertFalse(storage.exists('posts/copy.gif'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class CollectMediaTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    def setUp(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, TEMP_MEDIA_ROOT, True)
+        caches['thumbnails'].clear()
+        self.post = Post.objects.create(
+            author=self.user, text='Картинка',
+            image=SimpleUploadedFile('small.gif', SMALL_GIF, 'image/gif'))
+        self.thumbnail = thumbnails.get_picture(self.post.image).url
+        self.storage = Post._meta.get_field('image').storage
+        self.orphan = self.storage.save('posts/orphan.gif',
+                                        ContentFile(SMALL_GIF))
+        self.fresh = self.storage.save('posts/fresh.gif',
+                                       ContentFile(SMALL_GIF))
+        old = time.time() - 2 * 60 * 60
+        for root, _, files in os.walk(TEMP_MEDIA_ROOT):
+            for name in files:
+                if name != 'fresh.gif':
+                    os.utime(os.path.join(root, name), (old, old))
+
+    def collect(self, *args):
+        stdout = StringIO()
+        call_command('collect_media', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_dry_run(self):
+        """--dry-run только перечисляет файлы без ссылок"""
+        output = self.collect('--dry-run')
+        self.assertIn(self.orphan, output)
+        self.assertIn('Можно освободить: 1 файлов', output)
+        self.assertTrue(self.storage.exists(self.orphan))
+
+    def test_collect(self):
+        """Файлы без ссылок удаляются, используемые и новые остаются"""
+        self.post.delete()
+        output = self.collect()
+        self.assertIn('Удалено:', output)
+        self.assertFalse(self.storage.exists(self.orphan))
+        self.assertTrue(self.storage.exists(self.fresh))
+        for path in (self.thumbnail, self.post.image.name):
+            self.assertFalse(
+                self.storage.exists(path.replace(settings.MEDIA_URL, '')))
+
+    def test_reupload_during_collect_kept(self):
+        """Файл, загруженный заново или занятый после сбора ссылок, цел"""
+        name = images.hashed_name('ab' * 32, 'copy.gif')
+        self.storage.save(name, ContentFile(SMALL_GIF))
+        old = time.time() - 2 * 60 * 60
+        os.utime(self.storage.path(name), (old, old))
+        self.assertEqual(self.storage.save(name, ContentFile(SMALL_GIF)),
+                         name)
+        with mock.patch.object(collect_media.Command, 'referenced',
+                               return_value=set()):
+            self.collect()
+        self.assertTrue(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(self.post.image.name))
+        self.assertFalse(self.storage.exists(self.orphan))
+
+    def test_referenced_kept(self):
+        """Картинка поста и ее миниатюры не трогаются"""
+        self.collect('--quarantine')
+        self.assertTrue(self.storage.exists(self.post.image.name))
+        self.assertTrue(self.storage.exists(
+            self.thumbnail.replace(settings.MEDIA_URL, '')))
+        self.assertFalse(self.storage.exists(self.orphan))
+        self.assertTrue(os.path.exists(os.path.join(
+            TEMP_MEDIA_ROOT, '.quarantine', self.orphan)))
@@ -33,7 +33,8 @@ class StaticURLTests(TestCase):
             '/',
             f'/group/{self.group.slug}/',
             f'/profile/{self.user.username}/',
-            f'/posts/{self.post.pk}/'])
+            f'/posts/{self.post.pk}/',
+            f'/posts/{self.post.pk}/comments/'])
 
         for address in templates_url_names:
             with self.subTest(address=address):
@@ -1,14 +1,42 @@
+import gzip
+import json
+from datetime import timedelta
+import re
+import shutil
+import tempfile
+import warnings
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django import forms
-from posts.models import Post, Group, Comment
+from core.compression import compress_shell
+from core.decorators import QueryBudgetExceeded, query_budget
+from posts import cards, thumbnails
+from posts.cache import (AUTHOR_SCOPE, GENERATION_KEY, GROUP_SCOPE,
+                         MODIFIED_KEY, scope_key)
+from posts.models import Post, Group, Comment, Fallow, Timeline
+from posts.paginator import EstimatedCountPaginator
 
 User = get_user_model()
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
 
 
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
 class TaskPagesTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -50,7 +78,13 @@ class TaskPagesTests(TestCase):
             text='Тестовый комментарий'
         )
 
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user1)
@@ -212,6 +246,7 @@ class PaginatorViewsTest(TestCase):
             )
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
 
     def test_first_page_contains_ten_records(self):
@@ -241,38 +276,811 @@ class PaginatorViewsTest(TestCase):
                 response = self.guest_client.get(reverse_name + '?page=2')
                 self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_cursor_navigation(self):
+        """Курсоры ведут на соседние и последнюю страницы"""
+        list_views = [
+            reverse('posts:group_list',
+                    kwargs={'slug': self.group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.user1.username})]
+        for reverse_name in list_views:
+            with self.subTest(reverse_name=reverse_name):
+                first_page = self.guest_client.get(
+                    reverse_name).context['page_obj']
+                response = self.guest_client.get(
+                    reverse_name, {'cursor': first_page.next_cursor})
+                second_page = response.context['page_obj']
+                self.assertEqual(len(second_page), 3)
+                self.assertFalse(second_page.has_next())
+                response = self.guest_client.get(
+                    reverse_name, {'cursor': second_page.previous_cursor})
+                self.assertEqual(
+                    list(response.context['page_obj']), list(first_page))
+                response = self.guest_client.get(
+                    reverse_name, {'cursor': first_page.last_cursor})
+                last_page = response.context['page_obj']
+                self.assertFalse(last_page.has_next())
+                self.assertEqual(last_page[len(last_page) - 1],
+                                 second_page[len(second_page) - 1])
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор отдает первую страницу"""
+        response = self.guest_client.get(
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            {'cursor': 'не-курсор'})
+        self.assertEqual(response.context['page_obj'].number, 1)
+        self.assertEqual(len(response.context['page_obj']), 10)
+
 
 class CacheTest(TestCase):
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
         cls.user = User.objects.create_user(username='testuser')
-        post = Post.objects.create(
+        cls.group = Group.objects.create(
+            title='someee',
+            slug='some_people',
+            description='everyyy some day'
+        )
+        cls.post = Post.objects.create(
             text='Тестовый пост',
             author=cls.user,
+            group=cls.group,
         )
         cls.INDEX = reverse('posts:index')
+        cls.GROUP = reverse('posts:group_list', kwargs={'slug': 'some_people'})
+        cls.PROFILE = reverse('posts:profile',
+                              kwargs={'username': 'testuser'})
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.user = User.objects.create_user(username='new_user')
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
 
     def test_cache(self):
-        response_1 = self.authorized_client.get(self.INDEX)
-        new_post = Post.objects.create(
+        """Повторный запрос страницы не обращается к базе"""
+        # только сессия и пользователь, в профиле еще кнопка подписки
+        queries = {self.INDEX: 2, self.GROUP: 2, self.PROFILE: 3}
+        for address, count in queries.items():
+            with self.subTest(address=address):
+                response_1 = self.authorized_client.get(address)
+                with self.assertNumQueries(count):
+                    response_2 = self.authorized_client.get(address)
+                self.assertEqual(response_1.content, response_2.content)
+
+    def test_cache_shared_between_users(self):
+        """Оболочка страницы общая, фрагменты пользователя свои"""
+        self.guest_client.get(self.PROFILE)
+        with self.assertNumQueries(3):
+            response = self.authorized_client.get(self.PROFILE)
+        self.assertContains(response, 'Пользователь: new_user')
+        self.assertContains(response, 'Подписаться')
+        self.assertNotContains(response, '<!--hole:')
+
+        Fallow.objects.create(user=self.user, author=self.post.author)
+        other = Client()
+        other.force_login(User.objects.create_user(username='other'))
+        self.authorized_client.get(self.PROFILE)
+        response = other.get(self.PROFILE)
+        self.assertContains(response, 'Пользователь: other')
+        self.assertNotContains(response, 'new_user')
+        self.assertContains(response, 'Подписаться')
+        self.assertContains(self.authorized_client.get(self.PROFILE),
+                            'Отписаться')
+        response = self.guest_client.get(self.PROFILE)
+        self.assertContains(response, 'Войти')
+        self.assertNotContains(response, 'Пользователь:')
+
+    def test_gzip(self):
+        """Клиенту с gzip отдается сжатая при заполнении кеша страница"""
+        plain = self.authorized_client.get(self.PROFILE)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        with self.assertNumQueries(3):
+            response = self.authorized_client.get(
+                self.PROFILE, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertNotEqual(response['ETag'], plain['ETag'])
+        content = gzip.decompress(response.content)
+        self.assertIn('Пользователь: new_user'.encode(), content)
+        self.assertNotIn(b'<!--hole:', content)
+        # токен CSRF маскируется заново в каждом ответе
+        token = re.compile(rb'csrfmiddlewaretoken" value="\w+"')
+        self.assertEqual(token.sub(b'', content),
+                         token.sub(b'', plain.content))
+        response = self.guest_client.get(
+            self.PROFILE, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertIn('Войти'.encode(), gzip.decompress(response.content))
+
+    def test_compressed_shell_keeps_bounds_only(self):
+        """Сжатая оболочка хранит границы кусков в байтах, а не их копии"""
+        content = 'Привет<!--hole:csrf:-->мир'.encode()
+        shell = compress_shell(content, 'utf-8')
+        self.assertEqual([segment[:2] for segment in shell.segments],
+                         [(0, 12), (29, 35)])
+        self.assertEqual(shell.holes, [('csrf', '')])
+
+    def test_scope_keys_portable(self):
+        """Ключи областей годятся для memcached при любом слаге и имени"""
+        scopes = (GROUP_SCOPE.format(slug='Тестовый слаг'),
+                  AUTHOR_SCOPE.format(username='Пользователь'))
+        for scope in scopes:
+            for template in (GENERATION_KEY, MODIFIED_KEY):
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter('always')
+                    cache.validate_key(scope_key(template, scope))
+                self.assertEqual(caught, [])
+
+    def test_cache_invalidated_on_write(self):
+        """Новый пост, комментарий и группа сразу видны на страницах"""
+        responses = {
+            address: self.guest_client.get(address).content
+            for address in (self.INDEX, self.GROUP, self.PROFILE)
+        }
+        Post.objects.create(
             text='Новый тестовый текст',
             author=self.user,
         )
-        response_2 = self.authorized_client.get(self.INDEX)
+        self.assertNotEqual(
+            responses[self.INDEX],
+            self.guest_client.get(self.INDEX).content
+        )
         self.assertEqual(
-            response_1.content,
-            response_2.content
-         )
+            responses[self.GROUP],
+            self.guest_client.get(self.GROUP).content
+        )
+        self.post.group = None
+        self.post.save()
+        for address in (self.GROUP, self.PROFILE):
+            with self.subTest(address=address):
+                self.assertNotEqual(
+                    responses[address],
+                    self.guest_client.get(address).content
+                )
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.assertContains(self.guest_client.get(self.GROUP),
+                            'Новое название')
+
+    def test_follow_invalidates_both_profiles(self):
+        """Подписка обновляет профили и автора, и подписчика"""
+        reader_profile = reverse('posts:profile',
+                                 kwargs={'username': self.user.username})
+        self.guest_client.get(self.PROFILE)
+        self.guest_client.get(reader_profile)
+        Fallow.objects.create(user=self.user, author=self.post.author)
+        self.assertContains(self.guest_client.get(self.PROFILE),
+                            'Подписчиков: 1')
+        self.assertContains(self.guest_client.get(reader_profile),
+                            'подписок: 1')
+
+
+class FollowTimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(
+            text='Старый пост',
+            author=cls.author,
+        )
+        cls.FOLLOW = reverse('posts:profile_follow',
+                             kwargs={'username': 'author'})
+        cls.UNFOLLOW = reverse('posts:profile_unfollow',
+                               kwargs={'username': 'author'})
+        cls.FEED = reverse('posts:follow_index')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def feed_posts(self):
+        response = self.authorized_client.get(self.FEED)
+        return [entry.post for entry in response.context['page_obj']]
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Подписка заполняет ленту, отписка очищает ее"""
+        self.assertEqual(self.feed_posts(), [])
+        self.authorized_client.get(self.FOLLOW)
+        self.assertEqual(self.feed_posts(), [self.old_post])
+        self.authorized_client.get(self.UNFOLLOW)
+        self.assertEqual(self.feed_posts(), [])
+        self.assertFalse(Timeline.objects.filter(user=self.reader).exists())
+
+    def test_new_post_fanned_out_to_followers(self):
+        """Новый пост попадает только в ленты подписчиков"""
+        stranger = User.objects.create_user(username='stranger')
+        self.authorized_client.get(self.FOLLOW)
+        new_post = Post.objects.create(text='Новый пост', author=self.author)
+        self.assertEqual(self.feed_posts(), [new_post, self.old_post])
+        self.assertFalse(Timeline.objects.filter(user=stranger).exists())
+
+    def test_old_posts_backfilled_on_demand(self):
+        """Посты старше первой порции переносятся, когда до них долистали
+
+        За запрос лента дозаполняется один раз, неполная страница
+        обрезается и ведет дальше: бюджет запросов соблюдается.
+        """
+        for number in range(1, 6):
+            # pub_date с auto_now_add задается только через update
+            Post.objects.filter(pk=Post.objects.create(
+                text=f'Архив {number}', author=self.author).pk).update(
+                    pub_date=self.old_post.pub_date - timedelta(days=number))
+        with mock.patch('posts.timeline.BACKFILL_LIMIT', 2):
+            self.authorized_client.get(self.FOLLOW)
+            self.assertEqual(
+                Timeline.objects.filter(user=self.reader).count(), 2)
+            # страница по номеру тоже укладывается в бюджет
+            response = self.authorized_client.get(self.FEED, {'page': 1})
+            self.assertTrue(response.context['page_obj'].has_next())
+            seen = []
+            cursor = ''
+            while True:
+                response = self.authorized_client.get(
+                    self.FEED, {'cursor': cursor} if cursor else {})
+                page = response.context['page_obj']
+                seen += [entry.post.text for entry in page]
+                if not page.has_next():
+                    break
+                cursor = page.next_cursor
+        self.assertEqual(seen, ['Старый пост'] + [
+            f'Архив {number}' for number in range(1, 6)])
+
+    def test_heavy_author_read_on_demand(self):
+        """Посты популярного автора подтягиваются при чтении ленты"""
+        self.authorized_client.get(self.FOLLOW)
+        with mock.patch('posts.timeline.FANOUT_LIMIT', 0):
+            new_post = Post.objects.create(text='Новый пост',
+                                           author=self.author)
+            self.assertFalse(
+                Timeline.objects.filter(post=new_post).exists())
+            self.assertEqual(self.feed_posts(), [new_post, self.old_post])
+
+    def test_heavy_author_burst_not_lost(self):
+        """Больше порции постов популярного автора между чтениями"""
+        self.authorized_client.get(self.FOLLOW)
+        self.feed_posts()
+        with mock.patch('posts.timeline.FANOUT_LIMIT', 0), \
+                mock.patch('posts.timeline.BACKFILL_LIMIT', 2):
+            posts = [Post.objects.create(text=f'Новый {number}',
+                                         author=self.author)
+                     for number in range(5)]
+            seen = []
+            cursor = ''
+            while True:
+                response = self.authorized_client.get(
+                    self.FEED, {'cursor': cursor} if cursor else {})
+                page = response.context['page_obj']
+                seen += [entry.post for entry in page]
+                if not page.has_next():
+                    break
+                cursor = page.next_cursor
+        self.assertEqual(seen, posts[::-1] + [self.old_post])
+        self.assertEqual(
+            Timeline.objects.filter(user=self.reader).count(), 6)
+
+
+class QueryBudgetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='someee',
+            slug='some_people',
+            description='everyyy some day'
+        )
+        cls.authors = [
+            User.objects.create_user(username=f'author{i}')
+            for i in range(3)
+        ]
+        for author in cls.authors:
+            Fallow.objects.create(user=cls.user, author=author)
+            for _ in range(4):
+                post = Post.objects.create(
+                    author=author, text='Текст', group=cls.group)
+                Comment.objects.create(
+                    post=post, author=cls.authors[0], text='Комментарий')
+                Comment.objects.create(
+                    post=post, author=cls.authors[1], text='Комментарий')
+        cls.post = post
+        cls.own_post = Post.objects.create(
+            author=cls.user, text='Свой пост', group=cls.group)
+
+    def setUp(self):
         cache.clear()
-        response_3 = self.authorized_client.get(self.INDEX)
-        self.assertNotEqual(
-            response_1.content,
-            response_3.content
-         )
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_views_fit_query_budget(self):
+        """Число запросов представлений не зависит от объема данных"""
+        author = self.authors[0].username
+        post_id = self.post.pk
+        addresses = [
+            ('get', reverse('posts:index'), {}),
+            ('get', reverse('posts:group_list',
+                            kwargs={'slug': self.group.slug}), {}),
+            ('get', reverse('posts:profile',
+                            kwargs={'username': author}), {}),
+            ('get', reverse('posts:post_detail',
+                            kwargs={'post_id': post_id}), {}),
+            ('get', reverse('posts:follow_index'), {}),
+            ('get', reverse('posts:post_create'), {}),
+            ('post', reverse('posts:post_create'),
+             {'text': 'Новый пост', 'group': self.group.pk}),
+            ('get', reverse('posts:post_edit',
+                            kwargs={'post_id': self.own_post.pk}), {}),
+            ('post', reverse('posts:post_edit',
+                             kwargs={'post_id': self.own_post.pk}),
+             {'text': 'Правка', 'group': ''}),
+            ('post', reverse('posts:add_comment',
+                             kwargs={'post_id': post_id}),
+             {'text': 'Еще комментарий'}),
+            ('get', reverse('posts:profile_unfollow',
+                            kwargs={'username': author}), {}),
+            ('get', reverse('posts:profile_follow',
+                            kwargs={'username': author}), {}),
+        ]
+        for method, address, data in addresses:
+            with self.subTest(address=address, method=method):
+                getattr(self.authorized_client, method)(address, data)
+
+    def test_budget_exceeded(self):
+        """Превышение бюджета запросов приводит к ошибке"""
+        @query_budget(1)
+        def view(request):
+            list(User.objects.all())
+            list(Group.objects.all())
+            return HttpResponse()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            view(RequestFactory().get('/'))
+
+
+class CommentsPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='oleiip')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'Комментарий {i}')
+            for i in range(25)
+        )
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_comments_paginated(self):
+        """Комментарии выводятся страницами, остальные — фрагментом"""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}))
+        comments = response.context['comments']
+        self.assertEqual(len(comments), 20)
+        self.assertEqual(comments[0].text, 'Комментарий 0')
+        self.assertTrue(comments.has_next())
+
+        response = self.guest_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.id}),
+            {'cursor': comments.next_cursor})
+        self.assertTemplateUsed(response, 'includes/comment.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        rest = response.context['comments']
+        self.assertEqual([comment.text for comment in rest],
+                         [f'Комментарий {i}' for i in range(20, 25)])
+        self.assertNotContains(response, 'data-more-comments')
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='oleiip')
+        cls.other = User.objects.create_user(username='fany')
+        cls.group = Group.objects.create(
+            title='someee', slug='some_people', description='everyyy')
+        cls.rare = Post.objects.create(
+            author=cls.user, text='Котики спят. Собаки лают.')
+        cls.often = Post.objects.create(
+            author=cls.other, group=cls.group,
+            text='Котики, котики и еще раз котики')
+        Post.objects.create(author=cls.user, text='Совсем про другое')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def search(self, **params):
+        response = self.guest_client.get(reverse('posts:search'), params)
+        return list(response.context['page_obj'])
+
+    def test_search_ranks_results(self):
+        """Поиск находит посты по префиксу и ставит выше релевантные"""
+        self.assertEqual(self.search(q='котик'), [self.often, self.rare])
+        self.assertEqual(self.search(q='собак котик'), [self.rare])
+        self.assertEqual(self.search(q=''), [])
+
+    def test_search_filters(self):
+        """Поиск можно ограничить группой и автором"""
+        self.assertEqual(self.search(q='котики', group='some_people'),
+                         [self.often])
+        self.assertEqual(self.search(q='котики', author='oleiip'),
+                         [self.rare])
+
+    def test_index_follows_post_changes(self):
+        """Индекс обновляется при изменении и удалении постов"""
+        post = Post.objects.create(author=self.user, text='Жирафы')
+        self.assertEqual(self.search(q='жирафы'), [post])
+        post.text = 'Слоны'
+        post.save()
+        self.assertEqual(self.search(q='жирафы'), [])
+        self.assertEqual(self.search(q='слоны'), [post])
+        post.delete()
+        self.assertEqual(self.search(q='слоны'), [])
+
+    def test_search_cursor_pages(self):
+        """Страницы выдачи листаются курсором с сохранением запроса"""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пингвин номер {i}')
+            for i in range(15))
+        response = self.guest_client.get(
+            reverse('posts:search'), {'q': 'пингвин'})
+        page = response.context['page_obj']
+        self.assertEqual(len(page), 10)
+        self.assertContains(response, '?q=%D0%BF%D0%B8%D0%BD%D0%B3%D0%B2'
+                                      '%D0%B8%D0%BD&amp;cursor=')
+        response = self.guest_client.get(
+            reverse('posts:search'),
+            {'q': 'пингвин', 'cursor': page.next_cursor})
+        rest = response.context['page_obj']
+        self.assertEqual(len(rest), 5)
+        self.assertFalse(set(page) & set(rest))
+
+    def test_admin_uses_index(self):
+        """Поиск в админке идет через полнотекстовый индекс"""
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        self.guest_client.force_login(admin)
+        response = self.guest_client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'собак'})
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.rare])
+
+
+class PostAdminTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password')
+        cls.groups = [
+            Group.objects.create(title=f'Группа {i}', slug=f'group_{i}',
+                                 description='Группа')
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.admin)
+
+    def changelist_queries(self, posts):
+        Post.objects.bulk_create(
+            Post(author=self.admin, group=self.groups[i % 5],
+                 text=f'Пост {i}')
+            for i in range(posts)
+        )
+        url = reverse('admin:posts_post_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow(self):
+        """Число запросов списка не зависит от числа строк и групп"""
+        few = self.changelist_queries(2)
+        many = self.changelist_queries(40)
+        self.assertEqual(few, many)
+
+    def test_estimated_count(self):
+        """Без фильтров число строк берется из статистики базы"""
+        Post.objects.bulk_create(
+            Post(author=self.admin, text=f'Пост {i}') for i in range(30))
+        paginator = EstimatedCountPaginator(Post.objects.all(), 10)
+        paginator.exact_threshold = 0
+        self.assertEqual(paginator.count, 30)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        Post.objects.bulk_create(
+            Post(author=self.admin, text=f'Пост {i}') for i in range(5))
+        paginator = EstimatedCountPaginator(Post.objects.all(), 10)
+        paginator.exact_threshold = 0
+        self.assertEqual(paginator.count, 30)
+        filtered = EstimatedCountPaginator(
+            Post.objects.filter(text__startswith='Пост'), 10)
+        filtered.exact_threshold = 0
+        self.assertEqual(filtered.count, 35)
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        cls.user = User.objects.create_user(username='oleiip')
+        cls.group = Group.objects.create(
+            title='someee', slug='some_people', description='everyyy')
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='Первый')
+        Comment.objects.create(post=cls.post, author=cls.staff, text='Ок')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.staff)
+
+    def export(self, **params):
+        response = self.client.get(reverse('posts:export'), params)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return response, [json.loads(line) for line in lines]
+
+    def test_export_is_incremental(self):
+        """Выгрузка идет потоком, курсор отдает только новые строки"""
+        response, rows = self.export()
+        self.assertEqual(
+            [(row['type'], row['text']) for row in rows],
+            [('post', 'Первый'), ('comment', 'Ок')])
+        self.assertEqual(rows[0]['author'], 'oleiip')
+        self.assertEqual(rows[0]['group'], 'some_people')
+
+        Post.objects.create(author=self.user, text='Второй')
+        response, rows = self.export(since=response['X-Export-Cursor'])
+        self.assertEqual([row['text'] for row in rows], ['Второй'])
+
+        _, rows = self.export(type='comment')
+        self.assertEqual([row['type'] for row in rows], ['comment'])
+
+    def test_export_staff_only(self):
+        """Выгрузка доступна только персоналу"""
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('posts:export'))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('posts:export'), {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='oleiip')
+        cls.group = Group.objects.create(
+            title='someee', slug='some_people', description='everyyy')
+        cls.post = Post.objects.create(
+            author=cls.user, group=cls.group, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def assertNotModified(self, client, url, **headers):
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_pages_answer_not_modified(self):
+        """Повторный запрос без изменений получает 304"""
+        urls = (
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('posts:profile', kwargs={'username': 'oleiip'}),
+            reverse('posts:group_list', kwargs={'slug': 'some_people'}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                etag = self.assertNotModified(self.guest_client, url)
+                Comment.objects.create(
+                    post=self.post, author=self.user, text='Новый')
+                response = self.guest_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_user(self):
+        """ETag у анонима и пользователя разный"""
+        url = reverse('posts:profile', kwargs={'username': 'oleiip'})
+        etag = self.guest_client.get(url)['ETag']
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_post_detail_versioned_by_etag(self):
+        """Страница поста проверяется по ETag, без Last-Modified"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.id})
+        comment = Comment.objects.create(
+            post=self.post, author=self.user, text='Последний')
+        etag = self.assertNotModified(self.guest_client, url)
+        self.assertFalse(self.guest_client.get(url).has_header(
+            'Last-Modified'))
+
+        # удаление последнего комментария не сдвигает дат вперед
+        comment.delete()
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        Post.objects.create(author=self.user, text='Счетчик автора')
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.id}),
+            data={'text': 'Правка', 'group': self.group.id})
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='oleiip')
+        cls.group = Group.objects.create(
+            title='someee', slug='some_people', description='everyyy')
+        Post.objects.bulk_create(
+            Post(author=cls.user, group=cls.group, text=f'Пост {i}')
+            for i in range(3))
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, variant='full'):
+        posts = list(Post.objects.select_related('author', 'group'))
+        with mock.patch('posts.cards.render_to_string',
+                        wraps=cards.render_to_string) as render:
+            html = cards.render_cards(posts, variant)
+        return html, render.call_count
+
+    def test_cards_rendered_once(self):
+        """Карточка рендерится один раз, пока пост не изменился"""
+        html, rendered = self.render()
+        self.assertEqual(rendered, 3)
+        self.assertIn('Пост 2', html[0])
+        self.assertIn('все записи группы', html[0])
+        self.assertEqual(self.render(), (html, 0))
+        self.assertEqual(self.render('group')[1], 3)
+
+        post = Post.objects.get(text='Пост 1')
+        post.text = 'Правка'
+        post.save()
+        Comment.objects.create(
+            post=Post.objects.get(text='Пост 0'), author=self.user, text='!')
+        html, rendered = self.render()
+        self.assertEqual(rendered, 2)
+        self.assertIn('Правка', html[1])
+        self.assertIn('Комментариев: 1', html[2])
+
+    def test_pages_use_cards(self):
+        """Страницы собираются из карточек"""
+        response = Client().get(reverse('posts:index'))
+        self.assertTemplateUsed(response, 'includes/post_card.html')
+        self.assertContains(response, '<article>', count=3)
+        self.assertContains(response, '<hr>', count=2)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='oleiip')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        caches['thumbnails'].clear()
+        self.post = Post.objects.create(
+            author=self.user, text='Картинка',
+            image=SimpleUploadedFile('thumb.gif', SMALL_GIF, 'image/gif'))
+
+    def picture(self):
+        return thumbnails.get_picture(self.post.image)
+
+    def test_original_until_ready(self):
+        """Пока миниатюры нет, страница отдает оригинал и не ждет Pillow"""
+        with mock.patch.object(thumbnails, '_submit') as submit:
+            response = Client().get(reverse('posts:index'))
+        self.assertEqual(submit.call_args[0][0].name, self.post.image.name)
+        self.assertContains(response, self.post.image.url)
+        self.assertContains(response, 'data-thumbnail-pending')
+        # место под оригинал по размеру из Post.image_width и image_height
+        self.assertContains(response, 'width="2" height="1"')
+        self.assertFalse(cache.get_many(
+            [cards.card_key(self.post, 'full')]))
+        # 304 оставил бы у клиента страницу с оригиналом
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertIn('no-store', response['Cache-Control'])
+
+        response = Client().get(reverse('posts:index'))
+        self.assertNotContains(response, 'data-thumbnail-pending')
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(self.picture().ready)
+
+    def test_pending_post_detail_not_stored(self):
+        """Страница поста с оригиналом тоже отдается без валидаторов"""
+        address = reverse('posts:post_detail', args=[self.post.pk])
+        with mock.patch.object(thumbnails, '_submit'):
+            response = Client().get(address)
+        self.assertContains(response, 'data-thumbnail-pending')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIn('no-store', response['Cache-Control'])
+        response = Client().get(address)
+        self.assertNotContains(response, 'data-thumbnail-pending')
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_pregenerate_after_commit(self):
+        """После сохранения формы миниатюры создаются заранее"""
+        thumbnails.pregenerate(self.post.image)
+        for _, _, geometry, options in thumbnails.variants():
+            self.assertIsNone(thumbnails.backend.get_ready_thumbnail(
+                self.post.image, geometry, **options))
+        for _, callback in connection.run_on_commit:
+            callback()
+        picture = self.picture()
+        self.assertTrue(picture.ready)
+        self.assertIn('/cache/', picture.url)
+        self.assertTrue(picture.url.endswith('.jpg'))
+
+    @override_settings(THUMBNAIL_WIDTHS=(320, 640))
+    def test_picture_variants(self):
+        """Для каждой ширины есть WebP и JPEG, страница отдает srcset"""
+        thumbnails._submit(self.post.image)
+        picture = self.picture()
+        self.assertEqual(picture.srcset.count('.jpg'), 2)
+        self.assertIn(' 320w', picture.srcset)
+        self.assertIn(' 640w', picture.srcset)
+        (mime, srcset), = picture.sources
+        self.assertEqual(mime, 'image/webp')
+        self.assertEqual(srcset.count('.webp'), 2)
+        response = Client().get(
+            reverse('posts:post_detail', args=[self.post.pk]))
+        self.assertContains(response, '<picture>')
+        self.assertContains(response, srcset)
+
+    def test_page_thumbnails_in_one_read(self):
+        """Миниатюры всех карточек страницы берутся одним чтением кеша"""
+        posts = [self.post] + [
+            Post.objects.create(
+                author=self.user, text='Картинка',
+                image=SimpleUploadedFile('thumb.gif', SMALL_GIF, 'image/gif'))
+            for _ in range(2)
+        ]
+        for post in posts:
+            thumbnails._submit(post.image)
+        posts = list(Post.objects.filter(pk__in=[post.pk for post in posts]))
+        store = caches['thumbnails']
+        with mock.patch.object(store, 'get', wraps=store.get) as get, \
+                mock.patch.object(store, 'get_many',
+                                  wraps=store.get_many) as get_many:
+            rendered = cards.render_cards(posts, 'full')
+        self.assertEqual(get_many.call_count, 1)
+        get.assert_not_called()
+        for card in rendered:
+            self.assertNotIn(thumbnails.PENDING_MARK, card)
+            self.assertIn('/cache/', card)
@@ -0,0 +1,252 @@
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.parsers import parse_geometry
+from sorl.thumbnail.kvstores.base import KVStoreBase, add_prefix
+
+logger = logging.getLogger(__name__)
+
+# Пропорции картинки поста и ширина, ближайшая к которой идет в src
+ASPECT = (960, 339)
+FALLBACK_WIDTH = 960
+# Форматы вариантов; первый из подходящих браузеру выбирается в <picture>,
+# последний — запасной для <img>
+FORMATS = (('WEBP', 'image/webp'), ('JPEG', 'image/jpeg'))
+
+# srcset — варианты запасного формата, sources — пары (тип, srcset),
+# width и height — размер картинки из url для атрибутов <img>
+Picture = namedtuple('Picture', 'url ready srcset sources width height')
+# Атрибут <img> с оригиналом вместо миниатюры: такой HTML не кешируется
+PENDING_MARK = 'data-thumbnail-pending'
+
+
+class KVStore(KVStoreBase):
+    """Хранилище ключей sorl только в кеше THUMBNAIL_CACHE, без базы.
+
+    Потерянная запись не страшна: файл миниатюры уже лежит в хранилище,
+    и sorl просто запишет ключ заново, не пересоздавая картинку.
+    """
+
+    @property
+    def cache(self):
+        return caches[thumbnail_settings.THUMBNAIL_CACHE]
+
+    def get_many(self, image_files):
+        """Словарь ключ -> ImageFile для найденных файлов, одним чтением."""
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        values = self.cache.get_many(list(keys))
+        return {keys[key]: deserialize_image_file(value)
+                for key, value in values.items() if value}
+
+    def thumbnail_names(self, image_files):
+        """Имена миниатюр этих картинок, записанных в хранилище."""
+        lists = self.cache.get_many(
+            [add_prefix(image_file.key, 'thumbnails')
+             for image_file in image_files])
+        values = self.cache.get_many(
+            [add_prefix(key) for value in lists.values() if value
+             for key in deserialize(value)])
+        return {deserialize_image_file(value).name
+                for value in values.values() if value}
+
+    def _get_raw(self, key):
+        return self.cache.get(key)
+
+    def _set_raw(self, key, value):
+        self.cache.set(key, value, None)
+
+    def _delete_raw(self, *keys):
+        self.cache.delete_many(keys)
+
+    def _find_keys_raw(self, prefix):
+        return self.cache.keys(prefix)
+
+
+class Backend(ThumbnailBackend):
+    """Бэкенд sorl, который умеет не создавать миниатюру в запросе."""
+
+    def full_options(self, source, options):
+        """Параметры с умолчаниями, как их дополняет get_thumbnail."""
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, file_, geometry, **options):
+        """Файл миниатюры с теми же именем и параметрами, что у тега."""
+        source = ImageFile(file_)
+        options = self.full_options(source, options)
+        name = self._get_thumbnail_filename(source, geometry, options)
+        return ImageFile(name, default.storage)
+
+    def encode(self, source, source_image, geometry, **options):
+        """Байты миниатюры без записи в хранилище — для замеров.
+
+        Картинку готовит движок sorl, а кодирует сам Pillow: приватный
+        engine._get_raw_data может поменяться в любой версии sorl.
+        """
+        options = self.full_options(source, options)
+        engine = default.engine
+        ratio = engine.get_image_ratio(source_image, options)
+        image = engine.create(
+            source_image, parse_geometry(geometry, ratio), options)
+        params = {'format': options['format'], 'quality': options['quality']}
+        if options['format'] == 'JPEG':
+            params['optimize'] = True
+            params['progressive'] = options.get(
+                'progressive', thumbnail_settings.THUMBNAIL_PROGRESSIVE)
+        buffer = BytesIO()
+        image.save(buffer, **params)
+        return buffer.getvalue()
+
+    def get_ready_thumbnail(self, file_, geometry, fresh=False, **options):
+        """Готовая миниатюра из хранилища ключей или None.
+
+        Сначала смотрит в найденное prefetch для этой картинки,
+        если не просили свежий ответ.
+        """
+        thumbnail = self.thumbnail_file(file_, geometry, **options)
+        found = getattr(file_, '_thumbnails', {})
+        if not fresh and thumbnail.key in found:
+            return found[thumbnail.key]
+        return default.kvstore.get(thumbnail)
+
+
+backend = Backend()
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def variants():
+    """Варианты картинки поста: (ширина, формат, геометрия, параметры)."""
+    ratio_width, ratio_height = ASPECT
+    for width in settings.THUMBNAIL_WIDTHS:
+        height = round(width * ratio_height / ratio_width)
+        for image_format, _ in FORMATS:
+            yield width, image_format, f'{width}x{height}', {
+                'crop': 'center', 'upscale': True, 'format': image_format}
+
+
+def _generate(source):
+    try:
+        for _, _, geometry, options in variants():
+            backend.get_thumbnail(source, geometry, **options)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', source.name)
+    finally:
+        with _lock:
+            _pending.discard(source.name)
+
+
+def _submit(image):
+    global _executor
+    # хранилище картинки входит в ключ миниатюры, поэтому передается
+    # вместе с именем, а не берется по умолчанию
+    source = ImageFile(image.name, image.storage)
+    name = source.name
+    with _lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+    workers = settings.THUMBNAIL_WORKERS
+    if not workers:
+        _generate(source)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            workers, thread_name_prefix='thumbnails')
+    _executor.submit(_generate, source)
+
+
+def pregenerate(image):
+    """Создает миниатюры картинки в фоне после коммита транзакции."""
+    if image:
+        source = ImageFile(image.name, image.storage)
+        transaction.on_commit(lambda: _submit(source))
+
+
+def prefetch(images):
+    """Находит готовые варианты всех картинок одним чтением кеша.
+
+    Результат запоминается на самих картинках, и get_picture
+    потом не обращается к хранилищу ключей.
+    """
+    images = [image for image in images if image]
+    files = [
+        [backend.thumbnail_file(image, geometry, **options)
+         for _, _, geometry, options in variants()]
+        for image in images
+    ]
+    found = default.kvstore.get_many(
+        [thumbnail for thumbnails in files for thumbnail in thumbnails])
+    for image, thumbnails in zip(images, files):
+        if not hasattr(image, '_thumbnails'):
+            image._thumbnails = {}
+        for thumbnail in thumbnails:
+            image._thumbnails[thumbnail.key] = found.get(thumbnail.key)
+
+
+def _ready_variants(image, fresh=False):
+    found = {}
+    for width, image_format, geometry, options in variants():
+        thumbnail = backend.get_ready_thumbnail(
+            image, geometry, fresh=fresh, **options)
+        if not thumbnail:
+            return None
+        found[width, image_format] = thumbnail
+    return found
+
+
+def _srcset(found, image_format):
+    return ', '.join(
+        f'{found[width, image_format].url} {width}w'
+        for width in settings.THUMBNAIL_WIDTHS)
+
+
+def get_picture(image):
+    """Варианты картинки для <picture>, если все они готовы.
+
+    Иначе оригинал и задача в пул: Pillow в запросе не работает.
+    Размер оригинала берется из Post.image_width и image_height,
+    размер варианта — из его геометрии: браузер заранее оставляет
+    под картинку место, и страница не прыгает при загрузке.
+    """
+    found = _ready_variants(image)
+    if found is None:
+        _submit(image)
+        if not settings.THUMBNAIL_WORKERS:
+            found = _ready_variants(image, fresh=True)
+    if found is None:
+        post = image.instance
+        return Picture(image.url, False, '', [],
+                       getattr(post, 'image_width', None),
+                       getattr(post, 'image_height', None))
+    fallback_format = FORMATS[-1][0]
+    fallback_width = min(settings.THUMBNAIL_WIDTHS,
+                         key=lambda width: abs(width - FALLBACK_WIDTH))
+    ratio_width, ratio_height = ASPECT
+    return Picture(
+        found[fallback_width, fallback_format].url, True,
+        _srcset(found, fallback_format),
+        [(mime, _srcset(found, image_format))
+         for image_format, mime in FORMATS[:-1]],
+        fallback_width, round(fallback_width * ratio_height / ratio_width))
@@ -0,0 +1,198 @@
+from itertools import islice
+
+from django.db.models import Max
+
+from posts.models import Fallow, Post, Timeline, UserStats
+from posts.paginator import CursorPage
+
+# Авторам с большим числом подписчиков лента не раскладывается при
+# публикации: их посты подтягиваются в ленту читателя при чтении.
+FANOUT_LIMIT = 1000
+# Сколько постов автора переносить в ленту за раз: при подписке
+# и когда читатель долистал до конца перенесенного, см. feed_page
+BACKFILL_LIMIT = 100
+BATCH_SIZE = 500
+
+
+def _entries(user_id, posts):
+    return (
+        Timeline(user_id=user_id, author_id=post.author_id, post_id=post.pk,
+                 pub_date=post.pub_date)
+        for post in posts
+    )
+
+
+def is_heavy(author_id):
+    return UserStats.objects.filter(
+        user_id=author_id, followers_count__gt=FANOUT_LIMIT).exists()
+
+
+def fan_out(post):
+    """Добавляет новый пост в ленты подписчиков автора."""
+    if is_heavy(post.author_id):
+        return
+    followers = Fallow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    Timeline.objects.bulk_create(
+        (Timeline(user_id=user_id, author_id=post.author_id, post=post,
+                  pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def _author_posts(author_id):
+    return Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk').only('pk', 'author_id', 'pub_date')
+
+
+def _copy(user_id, posts):
+    """Переносит в ленту до BACKFILL_LIMIT первых постов из posts.
+
+    Возвращает дату, старше которой посты остались не перенесены,
+    или None, если перенесены все.
+    """
+    batch = {post.pk: post for post in posts[:BACKFILL_LIMIT]}
+    horizon = None
+    if len(batch) == BACKFILL_LIMIT:
+        horizon = min(post.pub_date for post in batch.values())
+        # посты с той же датой переносятся все: дальше ищем строго старше
+        batch.update(
+            (post.pk, post) for post in posts.filter(pub_date=horizon))
+    Timeline.objects.bulk_create(
+        _entries(user_id, batch.values()),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    return horizon
+
+
+def backfill(user_id, author_id, since=None):
+    """Переносит в ленту последние посты автора.
+
+    Без since это первое заполнение после подписки: подписка запоминает,
+    докуда перенесены посты, остальные подтянет feed_page. С since
+    переносятся посты новее него; если их больше порции, подписка
+    запоминает разрыв так же, и feed_page дойдет до since.
+    """
+    posts = _author_posts(author_id)
+    if since is None:
+        Fallow.objects.filter(user_id=user_id, author_id=author_id).update(
+            backfilled_until=_copy(user_id, posts))
+        return
+    horizon = _copy(user_id, posts.filter(pub_date__gt=since))
+    if horizon is not None:
+        # более старый разрыв, если был, ниже since: feed_page пройдет
+        # уже перенесенные посты и продолжит с него
+        Fallow.objects.filter(user_id=user_id, author_id=author_id).update(
+            backfilled_until=horizon)
+
+
+def fan_out_many(posts):
+    """Раскладывает по лентам посты, добавленные в обход сигналов.
+
+    Посты группируются по авторам: один запрос подписчиков на автора,
+    а не на каждый пост, как в fan_out.
+    """
+    by_author = {}
+    for post in posts:
+        by_author.setdefault(post.author_id, []).append(post)
+    heavy = set(UserStats.objects.filter(
+        user_id__in=by_author, followers_count__gt=FANOUT_LIMIT,
+    ).values_list('user_id', flat=True))
+    for author_id, author_posts in by_author.items():
+        if author_id in heavy:
+            continue
+        followers = Fallow.objects.filter(
+            author_id=author_id).values_list('user_id', flat=True)
+        entries = (
+            entry
+            for user_id in followers.iterator()
+            for entry in _entries(user_id, author_posts)
+        )
+        # bulk_create превращает аргумент в список, поэтому режем сами
+        while True:
+            batch = list(islice(entries, BATCH_SIZE))
+            if not batch:
+                break
+            Timeline.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def prune(user_id, author_id):
+    Timeline.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def heavy_authors(user_id):
+    """Авторы из подписок пользователя, которым лента не раскладывается."""
+    return list(
+        Fallow.objects.filter(
+            user_id=user_id,
+            author__stats__followers_count__gt=FANOUT_LIMIT,
+        ).values_list('author_id', flat=True)
+    )
+
+
+def pull_heavy(user_id):
+    """Подтягивает в ленту новые посты популярных авторов."""
+    authors = heavy_authors(user_id)
+    if not authors:
+        return
+    synced = dict(
+        Timeline.objects.filter(user_id=user_id, author_id__in=authors)
+        .order_by()
+        .values('author_id')
+        .annotate(last=Max('pub_date'))
+        .values_list('author_id', 'last')
+    )
+    for author_id in authors:
+        backfill(user_id, author_id, since=synced.get(author_id))
+
+
+def _horizon(user):
+    """(автор, дата) подписки с самой поздней backfilled_until или None."""
+    return (
+        Fallow.objects.filter(user=user, backfilled_until__isnull=False)
+        .order_by('-backfilled_until')
+        .values_list('author_id', 'backfilled_until')
+        .first()
+    )
+
+
+def feed_page(user, get_page):
+    """Страница ленты, дозаполненной не больше одного раза за запрос.
+
+    Лента полна до самой поздней из дат Fallow.backfilled_until: старше
+    нее между записями могут не хватать постов. Если страница доходит
+    до этой даты, у подписки переносится следующая порция постов, и
+    get_page() строит страницу заново. Записи старше оставшейся даты
+    отрезаются, а страница получает ссылку дальше: следующий запрос
+    продолжит перенос. Так число запросов не зависит от объема ленты.
+    """
+    page = get_page()
+    found = _horizon(user)
+    if found is None:
+        return page
+    author_id, horizon = found
+    entries = list(page)
+    if page.has_next() and entries and entries[-1].pub_date >= horizon:
+        return page
+    Fallow.objects.filter(user=user, author_id=author_id).update(
+        backfilled_until=_copy(user.pk, _author_posts(author_id).filter(
+            pub_date__lt=horizon)))
+    page = get_page()
+    found = _horizon(user)
+    if found is None:
+        return page
+    horizon = found[1]
+    entries = [entry for entry in page if entry.pub_date >= horizon]
+    if len(entries) == len(page) and page.has_next():
+        return page
+    return CursorPage(entries, page.number, page.paginator,
+                      True, page.has_previous())
+
+
+def follow_feed(user):
+    pull_heavy(user.pk)
+    return Timeline.objects.filter(user=user).select_related(
+        'post__author', 'post__group')
@@ -1,19 +1,35 @@
-from django.core.paginator import Paginator
+import hashlib
+
 from django.shortcuts import render, get_object_or_404, redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
+from django.db import transaction
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import condition
+from core.decorators import query_budget
+from posts import export, thumbnails
+from posts.cache import (AUTHOR_SCOPE, GROUP_SCOPE, INDEX_SCOPE,
+                         cache_page_versioned, condition_versioned,
+                         no_store_pending)
 from posts.forms import PostForm, CommentForm
 from posts.models import Post, Group, User, Fallow
+from posts.paginator import CursorPaginator
+from posts.search import search_posts
+from posts.timeline import feed_page, follow_feed
 
 POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
 
 
-@cache_page(20, key_prefix='index_page')
+@query_budget(3)
+@condition_versioned(INDEX_SCOPE)
+@cache_page_versioned(PAGE_CACHE_TIMEOUT, INDEX_SCOPE)
 def index(request):
     posts = Post.objects.select_related('author', 'group')
-    paginator = Paginator(posts, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(posts, POSTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'),
+                                  request.GET.get('cursor'))
 
     context = {
         'page_obj': page_obj,
@@ -21,12 +37,15 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@query_budget(4)
+@condition_versioned(GROUP_SCOPE)
+@cache_page_versioned(PAGE_CACHE_TIMEOUT, GROUP_SCOPE)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     posts = group.posts.select_related('author')
-    paginator = Paginator(posts, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(posts, POSTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'),
+                                  request.GET.get('cursor'))
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -34,61 +53,125 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@query_budget(5)
+@condition_versioned(AUTHOR_SCOPE)
+@cache_page_versioned(PAGE_CACHE_TIMEOUT, AUTHOR_SCOPE)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
     posts = author.posts.select_related('group')
-    following = Fallow.objects.filter(user=request.user,
-                                      author=author).exists()
-    paginator = Paginator(posts, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(posts, POSTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'),
+                                  request.GET.get('cursor'))
     context = {
-        'following': following,
         'author': author,
         'page_obj': page_obj,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@query_budget(3)
+def search(request):
+    query = request.GET.get('q', '').strip()
+    posts = Post.objects.select_related('author', 'group')
+    if request.GET.get('group'):
+        posts = posts.filter(group__slug=request.GET['group'])
+    if request.GET.get('author'):
+        posts = posts.filter(author__username=request.GET['author'])
+    paginator = CursorPaginator(search_posts(query, posts), POSTS_PER_PAGE,
+                                ordering=('rank', 'pk'))
+    page_obj = paginator.get_page(request.GET.get('page'),
+                                  request.GET.get('cursor'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def post_etag(request, post_id):
+    """ETag страницы поста по отметкам, от которых она зависит.
+
+    Last-Modified не отдается: удаление комментария или новый пост
+    автора меняют страницу, но не сдвигают вперед ни одну дату.
+    """
+    version = (
+        Post.objects.filter(pk=post_id)
+        .values_list('updated_at', 'comments_count',
+                     'author__stats__posts_count')
+        .first()
+    )
+    if version is None:
+        return None
+    user_id = request.user.pk if request.user.is_authenticated else ''
+    return hashlib.md5('{}:{}:{}'.format(
+        request.get_full_path(), user_id, version).encode()).hexdigest()
+
+
+@query_budget(5)
+@no_store_pending
+@condition(etag_func=post_etag)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id)
     form = CommentForm()
     context = {
         'post': post,
         'form': form,
-        'comments': post.comments.all(),
+        'comments': get_comments_page(request, post),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@query_budget(3)
+def post_comments(request, post_id):
+    """Фрагмент со следующей страницей комментариев."""
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    context = {
+        'post': post,
+        'comments': get_comments_page(request, post),
+    }
+    return render(request, 'includes/comment.html', context)
+
+
+def get_comments_page(request, post):
+    paginator = CursorPaginator(post.comments.select_related('author'),
+                                COMMENTS_PER_PAGE, ordering=('created', 'pk'))
+    return paginator.get_page(cursor=request.GET.get('cursor'))
+
+
+@query_budget(10)
 @login_required
+@transaction.atomic
 def post_create(request):
-    if request.method == 'POST':
-        form = PostForm(request.POST, files=request.FILES or None,)
-        if form.is_valid():
-            post = form.save(commit=False)
-            post.author = request.user
-            post.save()
-            return redirect("posts:profile", post.author)
-    form = PostForm(request.POST or None)
+    # непрошедшая форма показывается с ошибками, в том числе картинки
+    form = PostForm(request.POST or None, files=request.FILES or None)
+    if form.is_valid():
+        post = form.save(commit=False)
+        post.author = request.user
+        post.save()
+        thumbnails.pregenerate(post.image)
+        return redirect("posts:profile", post.author)
     context = {
         'form': form,
     }
     return render(request, 'posts/create_post.html', context)
 
 
+@query_budget(10)
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    if post.author == request.user:
-        if request.method == 'POST':
-            form = PostForm(request.POST,
-                            files=request.FILES or None,
-                            instance=post)
-            if form.is_valid:
-                form.save()
-                return redirect('posts:post_detail', post_id)
-        form = PostForm(instance=post)
+    if post.author_id == request.user.pk:
+        form = PostForm(request.POST or None,
+                        files=request.FILES or None,
+                        instance=post)
+        if form.is_valid():
+            form.save(commit=False).save_edit()
+            if 'image' in form.changed_data:
+                thumbnails.pregenerate(post.image)
+            return redirect('posts:post_detail', post_id)
         context = {
             'form': form,
             'is_edit': True,
@@ -99,9 +182,12 @@ def post_edit(request, post_id):
     return redirect('posts:post_detail', post_id)
 
 
+@query_budget(7)
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(Post.objects.select_related('author', 'group'),
+                             pk=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -111,21 +197,31 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+# 6 запросов на дозаполнение ленты (posts.timeline.feed_page) и до 4 на
+# новые посты популярного автора (pull_heavy); бюджет — на одного такого
+@query_budget(16)
 @login_required
 def follow_index(request):
-    # информация о текущем пользователе доступна в переменной request.user
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # лента заранее собрана в Timeline, см. posts.timeline
+    entries = follow_feed(request.user)
+
+    def get_page():
+        paginator = CursorPaginator(entries, POSTS_PER_PAGE,
+                                    ordering=('-pub_date', '-post'))
+        return paginator.get_page(request.GET.get('page'),
+                                  request.GET.get('cursor'))
+
+    page_obj = feed_page(request.user, get_page)
     context = {
-        'posts': posts,
         'page_obj': page_obj,
+        'posts': [entry.post for entry in page_obj],
     }
     return render(request, 'posts/follow.html', context)
 
 
+@query_budget(15)
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
@@ -133,9 +229,30 @@ def profile_follow(request, username):
     return redirect('posts:profile', username=username)
 
 
+@query_budget(12)
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
         Fallow.objects.filter(user=request.user, author=author).delete()
     return redirect('posts:profile', username=username)
+
+
+@query_budget(4)
+@staff_member_required
+def export_posts(request):
+    """Выгрузка новых постов и комментариев в NDJSON потоком."""
+    try:
+        since = export.parse_cursor(request.GET.get('since'))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+    types = request.GET.getlist('type') or export.TYPES
+    upto = export.current_bounds()
+    response = StreamingHttpResponse(
+        export.export_lines(since, upto, types),
+        content_type='application/x-ndjson; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="posts.ndjson"'
+    # курсор для следующей выгрузки: ?since=<X-Export-Cursor>
+    response['X-Export-Cursor'] = export.format_cursor(upto)
+    return response
@@ -86,10 +86,20 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Общий для всех процессов кеш в отдельном файле SQLite;
+# тесты переносят файлы во временный каталог, см. core.test_runner
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+    },
+    # posts.thumbnails.KVStore: записи без срока, не вытесняются страницами
+    'thumbnails': {
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'thumbnails.sqlite3'),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
 }
 
 LOGIN_URL = 'users:login'
@@ -114,7 +124,45 @@ STATIC_URL = '/static/'
 
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
+# collectstatic кладет сюда файлы с хешем в имени и сжатые копии .gz;
+# без DEBUG их отдает core.views.static_files (или nginx с gzip_static)
+STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
+
+if not DEBUG:
+    STATICFILES_STORAGE = 'core.storage.CompressedManifestStaticFilesStorage'
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# core.decorators.query_budget: исключение вместо записи в лог
+QUERY_BUDGET_RAISE = False
+
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# core.media: кто передает байты файла. None — сам Django через
+# FileResponse, 'x-accel-redirect' — nginx (internal location
+# MEDIA_ACCEL_PREFIX с alias на MEDIA_ROOT), 'x-sendfile' — Apache
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Файлы, которые никогда не меняются: картинки постов с именем по хешу
+# и миниатюры sorl. Кешируются браузером на год
+MEDIA_IMMUTABLE = (
+    r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.',
+    r'^cache/',
+)
+
+# posts.images: пределы загружаемой картинки. Больше IMAGE_MAX_PIXELS
+# отклоняется до декодирования, большая сторона уменьшается до
+# IMAGE_MAX_SIDE
+IMAGE_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+IMAGE_MAX_SIDE = 2560
+
+# posts.thumbnails: потоки, создающие миниатюры; 0 — прямо в запросе
+THUMBNAIL_WORKERS = 2
+# posts.thumbnails: ширины вариантов картинки поста в WebP и JPEG
+THUMBNAIL_WIDTHS = (480, 960, 1440)
+
+THUMBNAIL_KVSTORE = 'posts.thumbnails.KVStore'
+THUMBNAIL_CACHE = 'thumbnails'
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import media, static_files
+
 
 urlpatterns = [
     path('', include('posts.urls', namespace='posts')),
@@ -8,6 +11,11 @@ urlpatterns = [
     path('auth/', include('users.urls', namespace='users')),
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', media,
+         name='media'),
+    # с DEBUG статику раньше перехватывает runserver из staticfiles
+    path(settings.STATIC_URL.lstrip('/') + '<path:path>', static_files,
+         name='static'),
 ]
 
 handler404 = 'core.views.page_not_found'